@@ -0,0 +1,78 @@
+import os
+
+from Crypto.Random.random import getrandbits, randint
+from Crypto.Util.number import getPrime, GCD, inverse
+
+# Selects the big-integer backend used by damgard.py: "gmpy2", "python", or "auto" (the
+# default), which uses gmpy2 when it is installed and falls back to plain Python ints.
+BACKEND_ENV = "DAMGARD_BACKEND"
+
+
+class PythonBackend:
+    name = "python"
+
+    def __init__(self):
+        self.mpz = int
+        self.powmod = pow
+        self.invert = inverse
+        self.gcd = GCD
+        self.get_prime = getPrime
+        self.randint = randint
+
+
+class Gmpy2Backend:
+    name = "gmpy2"
+
+    def __init__(self):
+        import gmpy2
+        self.mpz = gmpy2.mpz
+        self.powmod = gmpy2.powmod
+        self.invert = gmpy2.invert
+        self.gcd = gmpy2.gcd
+        self._next_prime = gmpy2.next_prime
+
+    def randint(self, a, b):
+        return self.mpz(randint(int(a), int(b)))
+
+    def get_prime(self, bits):
+        """Return a random prime of exactly the given bit length."""
+        while True:
+            start = self.mpz(getrandbits(bits) | (1 << (bits - 1)))
+            p = self._next_prime(start)
+            if p.bit_length() == bits:
+                return p
+
+
+BACKENDS = {
+    PythonBackend.name: PythonBackend,
+    Gmpy2Backend.name: Gmpy2Backend,
+}
+
+
+def load_backend(name=None):
+    """Instantiate the named backend; with name None or "auto", prefer gmpy2 if available."""
+    name = (name or os.environ.get(BACKEND_ENV) or "auto").lower()
+    if name == "auto":
+        try:
+            return Gmpy2Backend()
+        except ImportError:
+            return PythonBackend()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend {name!r}, expected one of {sorted(BACKENDS)} or 'auto'")
+    return BACKENDS[name]()
+
+
+current = load_backend()
+
+
+def set_backend(name):
+    """Switch the backend used by damgard.py.
+
+    The choice is also exported through the environment so that worker processes started
+    by pir.py use the same backend. Keys and ciphertexts created before the switch keep the
+    integer type they were created with.
+    """
+    global current
+    current = load_backend(name)
+    os.environ[BACKEND_ENV] = current.name
+    return current
@@ -0,0 +1,184 @@
+import argparse
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+
+import backend
+from damgard import *
+from pir import HypercubePIR, dot, encrypt_selection
+
+
+def measure(fn, warmup=1, repeat=7, min_sample_ns=20_000_000):
+    """Time fn() with time.perf_counter_ns; return per-call statistics in ns.
+
+    After warmup untimed calls, the number of calls per sample is doubled until one sample
+    takes at least min_sample_ns (as timeit.autorange does), so fast primitives are not
+    dominated by timer resolution. Then repeat samples are taken.
+    """
+    for _ in range(warmup):
+        fn()
+    number = 1
+    while True:
+        start = time.perf_counter_ns()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter_ns() - start
+        if elapsed >= min_sample_ns or number >= 1 << 20:
+            break
+        number *= 2
+    samples = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter_ns()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter_ns() - start) / number)
+    q1, _, q3 = statistics.quantiles(samples, n=4, method="inclusive") if len(samples) > 1 else samples * 3
+    return {
+        "median_ns": statistics.median(samples),
+        "min_ns": min(samples),
+        "q1_ns": q1,
+        "q3_ns": q3,
+        "number": number,
+        "repeat": len(samples),
+    }
+
+
+def primitive_cases(pk, sk, s):
+    """(name, fn) for every single-ciphertext primitive at level s."""
+    n = pk.n
+    ns = n ** s
+    nsp1 = ns * n
+    sk.set_s(s)
+    m = random.randrange(ns)
+    c1 = Damgard.encrypt_single(pk.g, m, ns, nsp1)
+    c2 = Damgard.encrypt_single(pk.g, random.randrange(ns), ns, nsp1)
+    noise = Damgard.noise_single(n, ns, nsp1)
+    u = backend.current.powmod(c1, sk.d, nsp1)
+    return [
+        ("encrypt_single", lambda: Damgard.encrypt_single(pk.g, m, ns, nsp1)),
+        ("encrypt_single_fast", lambda: Damgard.encrypt_single_fast(n, s, m, noise, nsp1)),
+        ("noise_single", lambda: Damgard.noise_single(n, ns, nsp1)),
+        ("add_single", lambda: Damgard.add_single(c1, c2, nsp1)),
+        ("mul_single", lambda: Damgard.mul_single(c1, m, nsp1)),
+        ("decrypt_single", lambda: Damgard.decrypt_single(sk, c1)),
+        ("decrypt_single_crt", lambda: Damgard.decrypt_single_crt(sk, c1)),
+        ("reduce", lambda: Damgard.reduce(u, n, s, sk.reduce_table)),
+    ]
+
+
+def round_cases(pk, sk, s, rows):
+    """(name, fn) for a full query-answer-decode PIR round over rows random plaintexts."""
+    ns = pk.n ** s
+    database = [random.randrange(ns) for _ in range(rows)]
+    index = random.randrange(rows)
+    hypercube = HypercubePIR(rows, d=2, s=s)
+
+    def basic_round():
+        query = encrypt_selection(pk, index, rows, s=s, workers=1)
+        assert sk.decrypt(dot(query, database, workers=1))[0] == database[index]
+
+    def hypercube_round():
+        query = hypercube.query(pk, index, workers=1)
+        assert hypercube.decode(sk, hypercube.answer(query, database, workers=1)) == database[index]
+
+    return [("pir_round", basic_round), ("hypercube_round", hypercube_round)]
+
+
+def run(bits_list, s_list, rows_list, warmup, repeat, min_sample_ms, only=None):
+    results = []
+
+    def bench(name, bits, s, rows, fn):
+        if only and name not in only:
+            return
+        stats = measure(fn, warmup, repeat, min_sample_ms * 1_000_000)
+        results.append({"name": name, "bits": bits, "s": s, "rows": rows, **stats})
+        print(f"{name:<20} bits={bits} s={s} rows={rows if rows is not None else '-':<6} "
+              f"median {stats['median_ns'] / 1e3:12.1f} us ({stats['number']} x {stats['repeat']})",
+              file=sys.stderr)
+
+    for bits in bits_list:
+        start = time.perf_counter_ns()
+        pk, sk = Damgard.keygen(bits // 2, s=1)
+        print(f"{bits}-bit key generated in {(time.perf_counter_ns() - start) / 1e9:.1f} s", file=sys.stderr)
+        for s in s_list:
+            # The primitives use sk at level s, so they run before the rounds switch its level
+            for name, fn in primitive_cases(pk, sk, s):
+                bench(name, bits, s, None, fn)
+            for rows in rows_list:
+                for name, fn in round_cases(pk, sk, s, rows):
+                    bench(name, bits, s, rows, fn)
+    return results
+
+
+def case_key(result):
+    return result["name"], result["bits"], result["s"], result["rows"]
+
+
+def compare(results, baseline, threshold):
+    """Regressions of results against baseline: cases whose median is slower by more than threshold."""
+    reference = {case_key(r): r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        base = reference.get(case_key(result))
+        if base is None:
+            continue
+        ratio = result["median_ns"] / base["median_ns"]
+        status = "SLOWER" if ratio > 1 + threshold else "ok"
+        name, bits, s, rows = case_key(result)
+        print(f"{status:<6} {name:<20} bits={bits} s={s} rows={rows if rows is not None else '-':<6} "
+              f"{base['median_ns'] / 1e3:12.1f} -> {result['median_ns'] / 1e3:12.1f} us ({ratio - 1:+.1%})")
+        if status != "ok":
+            regressions.append((result, base, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks of the Paillier/Damgard-Jurik primitives and PIR rounds")
+    parser.add_argument("--bits", type=int, nargs="*", default=[1024, 2048, 3072], help="modulus sizes")
+    parser.add_argument("--s", type=int, nargs="*", default=[1, 2, 3], help="Damgard-Jurik levels")
+    parser.add_argument("--rows", type=int, nargs="*", default=[64, 256, 1024], help="database sizes of the PIR rounds")
+    parser.add_argument("--only", nargs="*", default=None, help="benchmark only these cases (e.g. mul_single reduce)")
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--min-sample-ms", type=float, default=20, help="minimum duration of one timed sample")
+    parser.add_argument("--backend", choices=sorted(backend.BACKENDS) + ["auto"], default=None,
+                        help=f"big-integer backend (default: ${backend.BACKEND_ENV} or auto)")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the benchmark inputs")
+    parser.add_argument("--output", default=None, help="write the results as JSON to this file")
+    parser.add_argument("--compare", default=None, help="baseline JSON from an earlier --output")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="fail if any case is slower than the baseline by more than this fraction")
+    args = parser.parse_args()
+
+    if args.backend is not None:
+        backend.set_backend(args.backend)
+    random.seed(args.seed)
+    results = run(args.bits, args.s, args.rows, args.warmup, args.repeat, args.min_sample_ms, args.only)
+    report = {
+        "backend": backend.current.name,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "time": time.time(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("backend") != report["backend"]:
+            print(f"Warning: baseline used the {baseline.get('backend')} backend, this run {report['backend']}")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} case(s) slower than the baseline by more than {args.threshold:.0%}")
+            sys.exit(1)
+        print(f"No case slower than the baseline by more than {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
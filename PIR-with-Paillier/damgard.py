@@ -1,12 +1,14 @@
 import math
+import threading
+import weakref
+from collections import deque
 from typing import List
 
-from Crypto.Random.random import randint
-from Crypto.Util.number import getPrime, GCD, inverse
+import backend
 
 
 def lcm(x, y):
-    return x * (y // GCD(x, y))
+    return x * (y // backend.current.gcd(x, y))
 
 
 def crt(a_list: List[int], n_list: List[int]) -> int:
@@ -19,13 +21,15 @@ def crt(a_list: List[int], n_list: List[int]) -> int:
 
     N = math.prod(n_list)
     y_list = [N // n_i for n_i in n_list]
-    z_list = [inverse(y_i, n_i) for y_i, n_i in zip(y_list, n_list)]
+    z_list = [backend.current.invert(y_i, n_i) for y_i, n_i in zip(y_list, n_list)]
     x = sum(a_i * y_i * z_i for a_i, y_i, z_i in zip(a_list, y_list, z_list))
 
     return x
 
 
 class DamgardCiphertext:
+    __slots__ = ("n", "g", "s", "ns", "values")
+
     def __init__(self, n, g, s, values, ns=None):
         self.n = n
         self.g = g
@@ -43,9 +47,12 @@ class DamgardCiphertext:
             return self.add_pt(other)
 
     def add_pt(self, m):
-        pk = DamgardPublicKey(self.n, self.g)
-        ct = pk.encrypt([m], self.s)
-        return self.add_ct(ct)
+        nsp1 = self.ns * self.n
+        if self.g == self.n + 1:
+            c = Damgard.encrypt_single_fast(self.n, self.s, m, Damgard.noise_single(self.n, self.ns, nsp1), nsp1)
+        else:
+            c = Damgard.encrypt_single(self.g, m, self.ns, nsp1)
+        return self.add_ct(DamgardCiphertext(self.n, self.g, self.s, [c], ns=self.ns))
 
     def add_ct(self, ct2):
         """Perform homomorphic addition of two ciphertexts."""
@@ -62,25 +69,180 @@ class DamgardCiphertext:
         values = [Damgard.mul_single(self.values[i], m, nsp1) for i in range(len(self.values))]
         return DamgardCiphertext(self.n, self.g, self.s, values, ns=self.ns)
 
+    def dot(self, m):
+        """Homomorphic dot product with the plaintext vector m, i.e. Enc(sum_i x_i * m_i).
+
+        Computes prod_i c_i^(m_i) with a single multi-exponentiation instead of one pow()
+        and one addition per element.
+        """
+        assert len(self.values) == len(m), "can't take dot product of unequal lengths"
+        value = Damgard.multi_exp(self.values, m, self.ns * self.n)
+        return DamgardCiphertext(self.n, self.g, self.s, [value], ns=self.ns)
+
+    def to_vector(self):
+        return CiphertextVector.from_values(DamgardContext(self.n, self.s, self.g), self.values)
+
+
+class DamgardContext:
+    """Parameters shared by all ciphertexts under one (n, s, g).
+
+    Contexts are interned, so every vector under the same key references one instance
+    instead of carrying its own copies of n, n^s and n^(s+1).
+    """
+    __slots__ = ("n", "g", "s", "ns", "nsp1", "width", "__weakref__")
+    _interned = weakref.WeakValueDictionary()
+
+    def __new__(cls, n, s, g=None):
+        g = n + 1 if g is None else g
+        key = (int(n), s, int(g))
+        ctx = cls._interned.get(key)
+        if ctx is None:
+            ctx = super().__new__(cls)
+            ctx.n = n
+            ctx.g = g
+            ctx.s = s
+            ctx.ns = n ** s
+            ctx.nsp1 = ctx.ns * n
+            ctx.width = (int(ctx.nsp1 - 1).bit_length() + 7) // 8
+            cls._interned[key] = ctx
+        return ctx
+
+    def __reduce__(self):
+        return DamgardContext, (self.n, self.s, self.g)
+
+
+class CiphertextVector:
+    """A vector of ciphertexts stored as one contiguous buffer of fixed-width little-endian limbs.
+
+    Each ciphertext takes exactly ctx.width bytes. Elements are decoded to ints on access,
+    and iadd/imul update the buffer in place without allocating per-element objects.
+    """
+    __slots__ = ("ctx", "buffer")
+
+    def __init__(self, ctx, count=0, buffer=None):
+        self.ctx = ctx
+        if buffer is None:
+            buffer = bytearray(count * ctx.width)
+        assert len(buffer) % ctx.width == 0, "buffer is not a whole number of ciphertexts"
+        self.buffer = buffer
+
+    @classmethod
+    def from_values(cls, ctx, values):
+        width = ctx.width
+        return cls(ctx, buffer=bytearray(b"".join(int(v).to_bytes(width, "little") for v in values)))
+
+    def __len__(self):
+        return len(self.buffer) // self.ctx.width
+
+    @property
+    def nbytes(self):
+        return len(self.buffer)
+
+    def _index(self, i):
+        count = len(self)
+        if i < 0:
+            i += count
+        if not 0 <= i < count:
+            raise IndexError("CiphertextVector index out of range")
+        return i
+
+    def __getitem__(self, i):
+        width = self.ctx.width
+        i = self._index(i)
+        return int.from_bytes(memoryview(self.buffer)[i * width:(i + 1) * width], "little")
+
+    def __setitem__(self, i, value):
+        width = self.ctx.width
+        i = self._index(i)
+        self.buffer[i * width:(i + 1) * width] = int(value).to_bytes(width, "little")
+
+    def __iter__(self):
+        width = self.ctx.width
+        view = memoryview(self.buffer)
+        for start in range(0, len(view), width):
+            yield int.from_bytes(view[start:start + width], "little")
+
+    def iadd(self, other):
+        """Homomorphically add other (a CiphertextVector under the same context) in place."""
+        assert other.ctx is self.ctx, "can't add ciphers under different parameters"
+        assert len(other) == len(self), "can't add ciphers of unequal length"
+        nsp1 = self.ctx.nsp1
+        for i, c in enumerate(other):
+            self[i] = Damgard.add_single(self[i], c, nsp1)
+        return self
+
+    def imul(self, m):
+        """Homomorphically multiply every element by the plaintext scalar m in place."""
+        nsp1 = self.ctx.nsp1
+        for i in range(len(self)):
+            self[i] = Damgard.mul_single(self[i], m, nsp1)
+        return self
+
+    __iadd__ = iadd
+    __imul__ = imul
+
+    def dot(self, m):
+        assert len(self) == len(m), "can't take dot product of unequal lengths"
+        return Damgard.multi_exp(list(self), m, self.ctx.nsp1)
+
+    def to_ciphertext(self):
+        ctx = self.ctx
+        return DamgardCiphertext(ctx.n, ctx.g, ctx.s, list(self), ns=ctx.ns)
+
 
 class DamgardSecretKey:
-    def __init__(self, n, s, phi):
+    def __init__(self, n, s, phi, p=None, q=None):
         self.s = s
         self.n = n
         self.phi = phi
+        self.p = p
+        self.q = q
         self.ns = None
         self.d = None
+        self.d_p = None
+        self.d_q = None
+        self.psp1 = None
+        self.qsp1 = None
+        self.qsp1_inv = None
+        self.reduce_table = None
+        self._levels = {}
         self.set_s(s)
 
+    @property
+    def has_factors(self):
+        return self.p is not None and self.q is not None and self.p != self.q
+
     def set_s(self, s):
+        """Switch the key to level s. Everything derived from (n, s) is computed once per s and cached."""
         self.s = s
-        self.ns = self.n ** s
-        self.d = crt(a_list=[0, 1], n_list=[self.phi, self.ns])
+        level = self._levels.get(s)
+        if level is None:
+            level = self._levels[s] = self._derive_level(s)
+        self.ns, self.d, self.psp1, self.qsp1, self.qsp1_inv, self.d_p, self.d_q, self.reduce_table = level
 
-    def decrypt(self, ct):
-        """Decrypt ciphertext ct with secret key sk."""
+    def _derive_level(self, s):
+        ns = self.n ** s
+        d = crt(a_list=[0, 1], n_list=[self.phi, ns])
+        psp1 = qsp1 = qsp1_inv = d_p = d_q = None
+        if self.has_factors:
+            # Z*_{p^(s+1)} has order p^s * (p - 1), so d can be reduced modulo it
+            psp1 = self.p ** (s + 1)
+            qsp1 = self.q ** (s + 1)
+            # Garner's coefficient for recombining the two halves (see decrypt_single_crt)
+            qsp1_inv = backend.current.invert(qsp1, psp1)
+            d_p = d % (self.p ** s * (self.p - 1))
+            d_q = d % (self.q ** s * (self.q - 1))
+        return ns, d, psp1, qsp1, qsp1_inv, d_p, d_q, Damgard.reduce_table(self.n, s)
+
+    def decrypt(self, ct, use_crt=True):
+        """Decrypt ciphertext ct with secret key sk.
+
+        Uses the CRT path when the prime factors are known, unless use_crt is False.
+        """
         if ct.s != self.s:
             self.set_s(ct.s)
+        if use_crt and self.has_factors:
+            return [Damgard.decrypt_single_crt(self, c) for c in ct.values]
         return [Damgard.decrypt_single(self, c) for c in ct.values]
 
 
@@ -89,53 +251,189 @@ class DamgardPublicKey:
         self.n = n
         self.g = g
 
-    def encrypt(self, m, s=10):
-        """Encrypt message m with public key pk."""
+    def encrypt(self, m, s=10, pool=None):
+        """Encrypt message m with public key pk.
+
+        With the standard generator g = n + 1, g^m is computed without a modexp and the
+        noise r^(n^s) is taken from pool when one is given (see DamgardNoisePool).
+        """
         ns = self.n ** s
         nsp1 = ns * self.n
-        values = [Damgard.encrypt_single(self.g, x, ns, nsp1) for x in m]
+        if self.g != self.n + 1:
+            values = [Damgard.encrypt_single(self.g, x, ns, nsp1) for x in m]
+        elif pool is None:
+            values = [Damgard.encrypt_single_fast(self.n, s, x, Damgard.noise_single(self.n, ns, nsp1), nsp1)
+                      for x in m]
+        else:
+            assert pool.n == self.n and pool.s == s, "noise pool was built for another key or s"
+            values = [Damgard.encrypt_single_fast(self.n, s, x, pool.pop(), nsp1) for x in m]
         return DamgardCiphertext(self.n, self.g, s, values, ns=ns)
 
+    def noise_pool(self, s=10, size=1024):
+        return DamgardNoisePool(self.n, s, size)
+
+
+class DamgardNoisePool:
+    """Refillable pool of precomputed encryption noise values r^(n^s) mod n^(s+1).
+
+    The pool can be filled offline with fill(), or kept topped up by a background thread
+    with start()/stop(). pop() never blocks: when the pool is empty the noise is computed
+    inline, so encryption stays correct (just slower) if the pool runs dry.
+    """
+
+    def __init__(self, n, s, size=1024):
+        self.n = n
+        self.s = s
+        self.ns = n ** s
+        self.nsp1 = self.ns * n
+        self.size = size
+        self._values = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+    def __len__(self):
+        return len(self._values)
+
+    def fill(self, count=None):
+        """Add count noise values (by default, enough to reach the target size)."""
+        if count is None:
+            count = self.size - len(self._values)
+        for _ in range(count):
+            self._values.append(Damgard.noise_single(self.n, self.ns, self.nsp1))
+
+    def pop(self):
+        try:
+            value = self._values.popleft()
+        except IndexError:
+            return Damgard.noise_single(self.n, self.ns, self.nsp1)
+        with self._cond:
+            self._cond.notify()
+        return value
+
+    def start(self):
+        """Start a daemon thread that refills the pool whenever it drops below its size.
+
+        Modular exponentiation holds the GIL, so the thread only helps when the client has idle time
+        between queries; use fill() to precompute everything up front instead.
+        """
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._refill, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._thread.join()
+        self._thread = None
+
+    def _refill(self):
+        while True:
+            with self._cond:
+                while not self._stopping and len(self._values) >= self.size:
+                    self._cond.wait()
+                if self._stopping:
+                    return
+            self._values.append(Damgard.noise_single(self.n, self.ns, self.nsp1))
+
 
 class Damgard:
     @staticmethod
     def keygen(bits, s=2):
         """Generate Damgard-Jurik key pair."""
-        p = getPrime(bits)
-        q = getPrime(bits)
+        p = backend.current.get_prime(bits)
+        q = backend.current.get_prime(bits)
         n = p * q
         g = n + 1
         phi = lcm((p - 1), (q - 1))
-        return DamgardPublicKey(n, g), DamgardSecretKey(n, s, phi)
+        return DamgardPublicKey(n, g), DamgardSecretKey(n, s, phi, p, q)
 
     @staticmethod
     def encrypt_single(g, m, ns, nsp1):
-        r = randint(1, nsp1)
-        while GCD(r, nsp1) != 1:
-            r = randint(1, nsp1)
-        return (pow(g, m, nsp1) * pow(r, ns, nsp1)) % nsp1
+        r = backend.current.randint(1, nsp1)
+        while backend.current.gcd(r, nsp1) != 1:
+            r = backend.current.randint(1, nsp1)
+        powmod = backend.current.powmod
+        return (powmod(g, m, nsp1) * powmod(r, ns, nsp1)) % nsp1
+
+    @staticmethod
+    def noise_single(n, ns, nsp1):
+        # r^(n^s) mod n^(s+1) only depends on r mod n, so sampling from Z_n is enough. A
+        # non-invertible r would reveal a factor of n, which happens with negligible
+        # probability, so the GCD check of encrypt_single is skipped.
+        r = backend.current.randint(1, n - 1)
+        return backend.current.powmod(r, ns, nsp1)
+
+    @staticmethod
+    def gpow_single(n, s, m, nsp1):
+        """Compute (n + 1)^m mod n^(s+1) as sum_{k<=s} C(m, k) * n^k, without a modexp."""
+        m = m % (nsp1 // n)
+        result = 1
+        binom = 1
+        nk = 1
+        for k in range(1, s + 1):
+            binom = binom * (m - k + 1) // k
+            if binom == 0:
+                break
+            nk *= n
+            result += binom * nk
+        return result % nsp1
+
+    @staticmethod
+    def encrypt_single_fast(n, s, m, noise, nsp1):
+        """Encrypt m under g = n + 1 using a precomputed noise value r^(n^s)."""
+        return Damgard.gpow_single(n, s, m, nsp1) * noise % nsp1
 
     @staticmethod
     def decrypt_single(sk, ct):
-        u = pow(ct, sk.d, sk.ns * sk.n)
-        l = Damgard.reduce(u, sk.n, sk.s)
+        u = backend.current.powmod(ct, sk.d, sk.ns * sk.n)
+        l = Damgard.reduce(u, sk.n, sk.s, sk.reduce_table)
         return l % sk.ns
 
     @staticmethod
-    def reduce(a: int, n: int, s: int) -> int:
-        def L(b: int) -> int:
-            return (b - 1) // n
+    def decrypt_single_crt(sk, ct):
+        """Same as decrypt_single, but exponentiates mod p^(s+1) and q^(s+1) separately."""
+        powmod = backend.current.powmod
+        u_p = powmod(ct % sk.psp1, sk.d_p, sk.psp1)
+        u_q = powmod(ct % sk.qsp1, sk.d_q, sk.qsp1)
+        # Garner: the u = u_q (mod q^(s+1)) that is u_p mod p^(s+1), already below n^(s+1)
+        u = u_q + sk.qsp1 * ((u_p - u_q) * sk.qsp1_inv % sk.psp1)
+        l = Damgard.reduce(u, sk.n, sk.s, sk.reduce_table)
+        return l % sk.ns
 
-        i = 0
+    @staticmethod
+    def reduce_table(n, s):
+        """Precompute the (n, s)-dependent constants of reduce.
+
+        For each j in 1..s this holds n^(j+1), n^j and n^(k-1) / k! mod n^j for k in 2..j.
+        """
+        table = []
         for j in range(1, s + 1):
+            nj = n ** j
+            coeffs = [n ** (k - 1) * backend.current.invert(math.factorial(k), nj) % nj for k in range(2, j + 1)]
+            table.append((nj * n, nj, coeffs))
+        return table
 
-            t_1 = L(a % (n ** (j + 1)))
+    @staticmethod
+    def reduce(a: int, n: int, s: int, table=None) -> int:
+        if table is None:
+            table = Damgard.reduce_table(n, s)
+
+        i = 0
+        for nj1, nj, coeffs in table:
+
+            t_1 = (a % nj1 - 1) // n
             t_2 = i
 
-            for k in range(2, j + 1):
+            for coeff in coeffs:
                 i = i - 1
-                t_2 = t_2 * i % (n ** j)
-                t_1 = t_1 - (t_2 * n ** (k - 1) * inverse(math.factorial(k), n ** j)) % n ** j
+                t_2 = t_2 * i % nj
+                t_1 = t_1 - (t_2 * coeff) % nj
             i = t_1
         return i
 
@@ -145,8 +443,72 @@ class Damgard:
 
     @staticmethod
     def mul_single(c1, m, nsp1):
-        return pow(c1, m, nsp1)
+        return backend.current.powmod(c1, m, nsp1)
 
+    @staticmethod
+    def multi_exp_window(count, bits):
+        """Pick the bucket window width minimising ceil(bits/w) * (count + 2^(w+1))."""
+        if count == 0 or bits == 0:
+            return 1
+        return min(range(1, min(bits, 20) + 1), key=lambda w: -(-bits // w) * (count + 2 ** (w + 1)))
+
+    @staticmethod
+    def multi_exp(bases, exponents, modulus, window=None):
+        """Compute prod_i bases[i]^exponents[i] mod modulus with Pippenger's bucket method.
+
+        Exponents are split into w-bit digits. For every digit position each base is
+        multiplied into the bucket of its digit (one multiplication per base), the buckets
+        are combined with running products (2^(w+1) multiplications) and the windows are
+        joined by w squarings. For N bases with b-bit exponents this costs about
+        (b/w) * (N + 2^(w+1)) + b multiplications instead of roughly 1.5 * b * N.
+        """
+        return Damgard.multi_exp_batch([bases], exponents, [modulus], window)[0]
+
+    @staticmethod
+    def exponent_digits(exponents, window):
+        """Split exponents into window-bit digits, most significant window first.
+
+        Returns one list per window of the (index, digit) pairs with a non-zero digit, which
+        is all the bucket method needs to know about the exponents.
+        """
+        assert all(e >= 0 for e in exponents), "multi_exp needs non-negative exponents"
+        bits = max((e.bit_length() for e in exponents), default=0)
+        mask = (1 << window) - 1
+        digits = []
+        for shift in range(-(-bits // window) * window - window, -1, -window):
+            digits.append([(i, d) for i, d in enumerate((e >> shift) & mask for e in exponents) if d])
+        return digits
+
+    @staticmethod
+    def multi_exp_batch(base_lists, exponents, moduli, window=None):
+        """multi_exp of the same exponents against several base vectors, each under its own modulus.
+
+        The exponents are decomposed into digits once and reused for every base vector,
+        which is what answering several PIR queries over the same database rows needs.
+        """
+        exponents = list(exponents)
+        if window is None:
+            bits = max((e.bit_length() for e in exponents), default=0)
+            window = Damgard.multi_exp_window(len(exponents), bits)
+        digits = Damgard.exponent_digits(exponents, window)
+        mask = (1 << window) - 1
+        results = []
+        for bases, modulus in zip(base_lists, moduli):
+            result = 1
+            for nonzero in digits:
+                for _ in range(window):
+                    result = result * result % modulus
+                buckets = [1] * (mask + 1)
+                for i, digit in nonzero:
+                    buckets[digit] = buckets[digit] * bases[i] % modulus
+                running = 1
+                window_acc = 1
+                for digit in range(mask, 0, -1):
+                    running = running * buckets[digit] % modulus
+                    window_acc = window_acc * running % modulus
+                result = result * window_acc % modulus
+            results.append(result % modulus)
+        return results
 
 if __name__ == "__main__":
     s = 4
@@ -160,6 +522,17 @@ if __name__ == "__main__":
     ciphertext_scaling = ciphertext1 * scale
     decrypted_sum = sk.decrypt(ciphertext_sum)
     decrypted_scaling = sk.decrypt(ciphertext_scaling)
+    assert decrypted_sum == sk.decrypt(ciphertext_sum, use_crt=False)
+    assert decrypted_scaling == sk.decrypt(ciphertext_scaling, use_crt=False)
+    # Once a level is cached, neither decryption path inverts anything per ciphertext
+    invert, inversions = backend.current.invert, []
+    backend.current.invert = lambda *args: inversions.append(args) or invert(*args)
+    try:
+        sk.decrypt(ciphertext_sum)
+        sk.decrypt(ciphertext_sum, use_crt=False)
+    finally:
+        backend.current.invert = invert
+    assert not inversions, "decryption computed modular inverses"
     plaintext_sum = [message1[i] + message2[i] for i in range(len(message1))]
     plaintext_scaling = [message1[i] * 5 for i in range(len(message1))]
     print(f"Sum of original messages: {plaintext_sum}, Decrypted sum: {decrypted_sum}")
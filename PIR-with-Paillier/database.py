@@ -0,0 +1,239 @@
+import mmap
+import os
+
+
+class Packing:
+    """Layout of row bytes inside Damgard-Jurik plaintexts modulo n^s.
+
+    A plaintext is split into slots of slot_bits bits (a whole number of bytes), each
+    carrying slot_bits bits of row data; pack() refuses values that would spill into the
+    next slot. By default a plaintext has a single slot of the largest whole number of
+    bytes below n^s. This is the only encoding of rows into plaintexts.
+
+    When a whole row fits in one slot, each slot carries a different row, so a plaintext
+    holds rows_per_plaintext() consecutive rows. A query then selects one such record of
+    rows instead of one row, which divides the query length and the server's
+    exponentiations by that factor at the same reply size. for_rows() picks this layout
+    whenever at least two rows fit in a plaintext.
+    """
+
+    def __init__(self, n, s=1, slot_bits=None):
+        self.capacity = (n ** s).bit_length() - 1
+        self.slot_bits = self.capacity // 8 * 8 if slot_bits is None else slot_bits
+        if self.slot_bits <= 0 or self.slot_bits % 8:
+            raise ValueError(f"slot_bits must be a positive multiple of 8, got {self.slot_bits}")
+        self.slots = self.capacity // self.slot_bits
+        if self.slots == 0:
+            raise ValueError(f"slot_bits ({self.slot_bits}) exceeds the {self.capacity}-bit plaintext space")
+        self.value_bytes = self.slot_bits // 8
+        self._slot_mask = (1 << self.slot_bits) - 1
+
+    @classmethod
+    def for_rows(cls, n, s, row_size, slot_bits=None):
+        """The layout for rows of row_size bytes, with slots of slot_bits if given.
+
+        By default, one row per slot if at least two rows fit in a plaintext, else a
+        single slot.
+        """
+        if slot_bits is not None:
+            return cls(n, s, slot_bits=slot_bits)
+        if 2 * 8 * row_size <= (n ** s).bit_length() - 1:
+            return cls(n, s, slot_bits=8 * row_size)
+        return cls(n, s)
+
+    def pack(self, values):
+        if len(values) > self.slots:
+            raise OverflowError(f"{len(values)} values don't fit in {self.slots} slots")
+        pt = 0
+        for t, v in enumerate(values):
+            if not 0 <= v <= self._slot_mask:
+                raise OverflowError(f"value {v} does not fit in {self.slot_bits} bits")
+            pt |= v << (t * self.slot_bits)
+        return pt
+
+    def unpack(self, pt, count=None):
+        count = self.slots if count is None else count
+        pt = int(pt)
+        return [(pt >> (t * self.slot_bits)) & self._slot_mask for t in range(count)]
+
+    def num_plaintexts(self, row_size):
+        return -(-row_size // (self.value_bytes * self.slots))
+
+    def rows_per_plaintext(self, row_size):
+        return self.slots if row_size <= self.value_bytes else 1
+
+    def num_records(self, num_rows, row_size):
+        """Length of a query over num_rows rows: one element per record of rows_per_plaintext rows."""
+        return -(-num_rows // self.rows_per_plaintext(row_size))
+
+    def encode_rows(self, rows):
+        """Plaintexts of one record: up to rows_per_plaintext rows, one per slot, or one longer row."""
+        if len(rows) == 1:
+            return self.encode_row(rows[0])
+        return [self.pack([int.from_bytes(row, "little") for row in rows])]
+
+    def encode_row(self, row):
+        """Split a bytes-like row into num_plaintexts(len(row)) packed plaintexts."""
+        step = self.value_bytes
+        values = [int.from_bytes(row[start:start + step], "little") for start in range(0, len(row), step)]
+        return [self.pack(values[start:start + self.slots]) for start in range(0, len(values), self.slots)]
+
+    def decode_row(self, plaintexts, row_size):
+        """Unpack the decrypted plaintexts of a single row back into its bytes."""
+        values = [v for pt in plaintexts for v in self.unpack(pt)]
+        return b"".join(v.to_bytes(self.value_bytes, "little") for v in values)[:row_size]
+
+    def decode(self, plaintexts, row_size, index):
+        """The bytes of row index, from the decrypted plaintexts of the record holding it."""
+        rows = self.rows_per_plaintext(row_size)
+        if rows == 1:
+            return self.decode_row(plaintexts, row_size)
+        return self.unpack(plaintexts[0])[index % rows].to_bytes(self.value_bytes, "little")[:row_size]
+
+
+class MmapDatabase:
+    """A PIR database of fixed-size rows stored back to back in a flat binary file.
+
+    The file is memory-mapped, so rows are served as zero-copy memoryview slices and
+    only the pages actually touched are resident. Rows are turned into the plaintexts the
+    server multiplies into the query through a Packing (blocks).
+
+    Opened writable, rows can be changed in place with update, insert and delete. Each
+    touches only the bytes of the rows involved, so it costs O(changed rows) whatever the
+    size of the database: rows are packed into plaintexts when a query is answered, so
+    there is no encoded copy to redo. The file grows geometrically and deleted rows at
+    the end are only zeroed, so it is remapped O(log N) times over N inserts and never
+    while shrinking; close() trims it to num_rows again. While it is open, the file may
+    therefore hold zero rows past num_rows, and other processes reading it must be told
+    num_rows. version counts the changes since the database was opened.
+    """
+
+    def __init__(self, path, row_size, writable=False, num_rows=None):
+        self.path = path
+        self.row_size = row_size
+        self.writable = writable
+        self.version = 0
+        self._file = open(path, "r+b" if writable else "rb")
+        self._map()
+        if num_rows is not None:
+            assert num_rows <= self.capacity, f"{self.path} has fewer than {num_rows} rows"
+            self.num_rows = num_rows
+
+    def _map(self):
+        size = os.fstat(self._file.fileno()).st_size
+        assert size % self.row_size == 0, f"{self.path} is not a whole number of {self.row_size}-byte rows"
+        self.capacity = self.num_rows = size // self.row_size
+        access = mmap.ACCESS_WRITE if self.writable else mmap.ACCESS_READ
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=access) if size else None
+        self._view = memoryview(self._mmap) if size else memoryview(b"")
+
+    def _unmap(self):
+        self._view.release()
+        if self._mmap is not None:
+            self._mmap.close()
+
+    @classmethod
+    def create(cls, path, rows, row_size, writable=False):
+        """Write rows (bytes-like, each at most row_size long and zero-padded) to path and open it."""
+        with open(path, "wb") as f:
+            for row in rows:
+                assert len(row) <= row_size, "row is larger than row_size"
+                f.write(row)
+                f.write(bytes(row_size - len(row)))
+        return cls(path, row_size, writable)
+
+    def close(self):
+        self._unmap()
+        if self.writable and self.capacity > self.num_rows:
+            self._file.truncate(self.num_rows * self.row_size)
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.num_rows
+
+    def row(self, i):
+        start = i * self.row_size
+        return self._view[start:start + self.row_size]
+
+    def num_records(self, packing):
+        return packing.num_records(self.num_rows, self.row_size)
+
+    def record(self, packing, r):
+        """The packed plaintexts of record r: rows r * k .. r * k + k - 1, k = rows_per_plaintext."""
+        k = packing.rows_per_plaintext(self.row_size)
+        return packing.encode_rows([self.row(i) for i in range(r * k, min((r + 1) * k, self.num_rows))])
+
+    def blocks(self, packing, start=0, stop=None, block_rows=1024):
+        """Stream records start..stop as (first_record, columns) blocks of at most block_rows records.
+
+        columns[j] lists the j-th packed plaintext of every record in the block, which is
+        the shape the server kernel consumes, so at most one block of encoded rows is alive
+        at a time.
+        """
+        stop = self.num_records(packing) if stop is None else stop
+        for first in range(start, stop, block_rows):
+            records = [self.record(packing, r) for r in range(first, min(first + block_rows, stop))]
+            yield first, [list(column) for column in zip(*records)]
+
+    def _grow(self):
+        num_rows = self.num_rows
+        self._unmap()
+        self._file.truncate(max(16, 2 * self.capacity) * self.row_size)
+        self._map()
+        self.num_rows = num_rows
+
+    def _check_row(self, row):
+        assert self.writable, "database was opened read-only"
+        if len(row) > self.row_size:
+            raise ValueError(f"row of {len(row)} bytes is larger than row_size {self.row_size}")
+
+    def _write(self, i, row):
+        start = i * self.row_size
+        self._view[start:start + len(row)] = row
+        self._view[start + len(row):start + self.row_size] = bytes(self.row_size - len(row))
+
+    def update(self, i, row):
+        """Replace row i with row (zero-padded to row_size)."""
+        if not 0 <= i < self.num_rows:
+            raise IndexError(f"row {i} out of range")
+        self._check_row(row)
+        self._write(i, row)
+        self.version += 1
+
+    def insert(self, row):
+        """Append row (zero-padded to row_size) and return its index."""
+        self._check_row(row)
+        if self.num_rows == self.capacity:
+            self._grow()
+        self.num_rows += 1
+        self._write(self.num_rows - 1, row)
+        self.version += 1
+        return self.num_rows - 1
+
+    def delete(self, i):
+        """Remove row i by moving the last row into its place.
+
+        Returns the former index of the moved row, or None if row i was the last one.
+        """
+        if not 0 <= i < self.num_rows:
+            raise IndexError(f"row {i} out of range")
+        assert self.writable, "database was opened read-only"
+        last = self.num_rows - 1
+        if i != last:
+            self._write(i, bytes(self.row(last)))
+        # Zeroed rather than truncated, so the file needs no remap and a later insert
+        # starts from a zero row
+        self._write(last, b"")
+        self.num_rows = last
+        self.version += 1
+        return last if i != last else None
+
+    def flush(self):
+        if self._mmap is not None:
+            self._mmap.flush()
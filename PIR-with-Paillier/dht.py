@@ -0,0 +1,323 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import struct
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from damgard import Damgard
+from database import MmapDatabase, Packing
+from preprocess import QueryStore
+from server import PIRClient, PIRServer
+
+# Node ids are ID_BITS-bit integers with Kademlia's XOR metric. Row b of a node's
+# database is its k-bucket b: a mask of the node's non-empty buckets (bit b set if bucket
+# b has contacts), then up to bucket_size contacts whose ids share exactly b leading bits
+# with the node's own id, each stored as (node index + 1, node id) so that the zero
+# padding of a short bucket reads as index 0, i.e. no contact.
+ID_BITS = 32
+MASK = struct.Struct(">I")
+CONTACT = struct.Struct(">II")
+
+
+def prefix_length(a, b):
+    """Number of leading bits that a and b (ID_BITS-bit ids) have in common."""
+    return ID_BITS - (a ^ b).bit_length()
+
+
+class LoopbackDHT:
+    """A Kademlia-style DHT whose nodes are PIRServers listening on loopback.
+
+    A lookup walks towards the node closest to a key. At every hop it retrieves the
+    bucket that shares one more bit with the key, and it does so with a PIR query, so the
+    node being asked never learns which bucket, and hence which key, was looked up. When
+    that bucket is empty, the closest node shares that bit with the node being asked
+    rather than with the key, so the walk continues towards the key with the bit flipped;
+    the mask in every row lets it skip the node's other empty buckets without querying
+    them. All
+    servers share one process pool for answering; batch_window_s and max_batch are passed
+    on to every PIRServer. The databases are writable, so churn() can change buckets while
+    lookups run.
+    """
+
+    def __init__(self, num_nodes, bucket_size=4, seed=0, workers=None, block_rows=1024, batch_window_s=0.0,
+                 max_batch=16):
+        rng = random.Random(seed)
+        self.ids = rng.sample(range(1 << ID_BITS), num_nodes)
+        self.bucket_size = bucket_size
+        self.row_size = MASK.size + bucket_size * CONTACT.size
+        self.workers = workers or os.cpu_count()
+        self.block_rows = block_rows
+        self.batch_window_s = batch_window_s
+        self.max_batch = max_batch
+        self.ports = []
+        self.servers = []
+        self.masks = []
+        self._dir = None
+        self._executor = None
+        self._rng = rng
+
+    def buckets(self, node):
+        rows = [[] for _ in range(ID_BITS)]
+        own = self.ids[node]
+        for other, other_id in enumerate(self.ids):
+            if other != node:
+                rows[prefix_length(own, other_id)].append((other, other_id))
+        # A real node only knows some of the nodes in its far buckets
+        return [self._rng.sample(row, min(len(row), self.bucket_size)) for row in rows]
+
+    @staticmethod
+    def encode_bucket(mask, bucket):
+        return MASK.pack(mask) + b"".join(CONTACT.pack(other + 1, other_id) for other, other_id in bucket)
+
+    @staticmethod
+    def mask(buckets):
+        return sum(1 << b for b, bucket in enumerate(buckets) if bucket)
+
+    async def churn(self, rng):
+        """Refill a random non-empty bucket of a random node with a fresh sample of its contacts.
+
+        This stands in for nodes joining and leaving: one row of one server's database
+        changes, and lookups keep converging since the bucket still only holds valid
+        contacts, and the node's mask of non-empty buckets stays the same. Returns the time
+        the server took to accept the update.
+        """
+        node = rng.randrange(len(self.ids))
+        own = self.ids[node]
+        others = [(other, other_id) for other, other_id in enumerate(self.ids) if other != node]
+        b = prefix_length(own, rng.choice(others)[1])
+        bucket = [contact for contact in others if prefix_length(own, contact[1]) == b]
+        row = self.encode_bucket(self.masks[node], rng.sample(bucket, min(len(bucket), self.bucket_size)))
+        start = time.perf_counter()
+        await self.servers[node].update(modify=[(b, row)])
+        return time.perf_counter() - start
+
+    async def start(self):
+        self._dir = tempfile.TemporaryDirectory(prefix="dht-")
+        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        for node in range(len(self.ids)):
+            buckets = self.buckets(node)
+            self.masks.append(self.mask(buckets))
+            rows = [self.encode_bucket(self.masks[node], bucket) for bucket in buckets]
+            db = MmapDatabase.create(os.path.join(self._dir.name, f"node-{node}.db"), rows, self.row_size,
+                                     writable=True)
+            server = PIRServer(db, executor=self._executor, block_rows=self.block_rows,
+                               batch_window_s=self.batch_window_s, max_batch=self.max_batch)
+            self.ports.append(await server.start())
+            self.servers.append(server)
+        return self
+
+    async def close(self):
+        for server in self.servers:
+            await server.close()
+            server.db.close()
+        if self._executor is not None:
+            self._executor.shutdown()
+        if self._dir is not None:
+            self._dir.cleanup()
+
+    def closest(self, key):
+        return min(range(len(self.ids)), key=lambda node: self.ids[node] ^ key)
+
+
+class LookupClient:
+    """Resolves keys over a LoopbackDHT, keeping one PIRClient connection per node visited.
+
+    With a QueryStore, its key pair is used and its precomputed queries are consumed.
+    """
+
+    def __init__(self, dht, pk, sk, s=1, store=None):
+        self.dht = dht
+        self.pk = pk
+        self.sk = sk
+        self.s = s
+        self.store = store
+        self._clients = {}
+
+    async def _client(self, node):
+        client = self._clients.get(node)
+        if client is None:
+            client = PIRClient(self.pk, self.sk, self.s, store=self.store, server=f"node-{node}")
+            await client.connect(port=self.dht.ports[node])
+            self._clients[node] = client
+        return client
+
+    async def close(self):
+        for client in self._clients.values():
+            await client.close()
+
+    async def lookup(self, key, start):
+        """Walk from node start to the node closest to key; return (node, hops)."""
+        ids = self.dht.ids
+        # target is the key with the bits flipped at which the closest node turned out to
+        # differ from it; the node whose id is target is the closest one to key
+        node, target, mask, hops = start, key, None, 0
+        while ids[node] != target:
+            b = prefix_length(ids[node], target)
+            if mask is None or mask >> b & 1:
+                client = await self._client(node)
+                row = await client.retrieve(b)
+                hops += 1
+                (mask,) = MASK.unpack_from(row)
+                contacts = [CONTACT.unpack_from(row, offset) for offset in range(MASK.size, len(row), CONTACT.size)]
+                contacts = [(slot - 1, other_id) for slot, other_id in contacts if slot != 0]
+                if contacts:
+                    node = min(contacts, key=lambda contact: contact[1] ^ target)[0]
+                    mask = None
+                    continue
+            target ^= 1 << (ID_BITS - 1 - b)
+        return node, hops
+
+
+async def simulate(num_nodes=16, clients=4, lookups=8, bucket_size=4, key_bits=1024, s=1, workers=None, seed=0,
+                   batch_window_s=0.0, max_batch=16, preprocess=0, churn=0.0):
+    """Run clients concurrent lookup loops against a fresh LoopbackDHT and collect latencies.
+
+    With preprocess > 0, every client gets a QueryStore holding that many precomputed
+    queries per node before the clock starts, so lookup latency only covers the online
+    part; the offline time is reported as preprocess_s.
+
+    With churn > 0, buckets are changed at that many updates per second across the DHT
+    (as fast as possible if infinite) for as long as the lookups run, and the achieved
+    update rate is reported next to the query rate.
+    """
+    dht = await LoopbackDHT(num_nodes, bucket_size, seed, workers, batch_window_s=batch_window_s,
+                            max_batch=max_batch).start()
+    rng = random.Random(seed + 1)
+    latencies, hops, update_latencies = [], [], []
+    stores = tempfile.TemporaryDirectory(prefix="dht-clients-") if preprocess else None
+    preprocess_s = 0.0
+    try:
+        lookup_clients = []
+        for i in range(clients):
+            if stores is None:
+                pk, sk = Damgard.keygen(key_bits // 2, s=s)
+                lookup_clients.append(LookupClient(dht, pk, sk, s))
+                continue
+            start = time.perf_counter()
+            store = QueryStore(os.path.join(stores.name, f"client-{i}"), key_bits)
+            pk, sk = store.keypair()
+            for node, server in enumerate(dht.servers):
+                store.sync(f"node-{node}", server.epoch)
+                num_records = server.db.num_records(Packing.for_rows(pk.n, s, server.db.row_size))
+                store.prepare(f"node-{node}", num_records, preprocess, s)
+            preprocess_s += time.perf_counter() - start
+            lookup_clients.append(LookupClient(dht, pk, sk, s, store))
+
+        async def loop(client):
+            for _ in range(lookups):
+                key = rng.randrange(1 << ID_BITS)
+                start = time.perf_counter()
+                node, count = await client.lookup(key, rng.randrange(num_nodes))
+                latencies.append(time.perf_counter() - start)
+                hops.append(count)
+                assert node == dht.closest(key), "lookup did not converge to the closest node"
+
+        async def churn_loop():
+            churn_rng = random.Random(seed + 2)
+            interval = 1 / churn
+            due = time.perf_counter()
+            while True:
+                due += interval
+                await asyncio.sleep(max(0.0, due - time.perf_counter()))
+                update_latencies.append(await dht.churn(churn_rng))
+
+        churner = asyncio.ensure_future(churn_loop()) if churn > 0 else None
+        start = time.perf_counter()
+        try:
+            await asyncio.gather(*(loop(client) for client in lookup_clients))
+        finally:
+            if churner is not None:
+                churner.cancel()
+                await asyncio.gather(churner, return_exceptions=True)
+        elapsed = time.perf_counter() - start
+        for client in lookup_clients:
+            await client.close()
+    finally:
+        await dht.close()
+        if stores is not None:
+            stores.cleanup()
+
+    queries = sum(server.queries for server in dht.servers)
+    batches = sum(server.batches for server in dht.servers)
+    busy = sum(server.busy_s for server in dht.servers)
+    wait = sum(server.wait_s for server in dht.servers)
+    updates = sum(server.updates for server in dht.servers)
+    update_s = sum(server.update_s for server in dht.servers)
+    ordered = sorted(latencies)
+    return {
+        "nodes": num_nodes,
+        "clients": clients,
+        "lookups": len(latencies),
+        "key_bits": key_bits,
+        "s": s,
+        "workers": dht.workers,
+        "batch_window_s": batch_window_s,
+        "max_batch": max_batch,
+        "preprocess": preprocess,
+        "preprocess_s": preprocess_s,
+        "elapsed_s": elapsed,
+        "latency_median_s": statistics.median(ordered),
+        "latency_p95_s": ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))],
+        "hops_mean": statistics.mean(hops),
+        "queries": queries,
+        "queries_per_s": queries / elapsed,
+        "server_time_per_query_s": busy / queries if queries else None,
+        "batch_size_mean": queries / batches if batches else None,
+        "batch_wait_mean_s": wait / queries if queries else None,
+        "churn": churn,
+        "updates": updates,
+        "updates_per_s": updates / elapsed,
+        "update_latency_median_s": statistics.median(update_latencies) if update_latencies else None,
+        "update_apply_mean_s": update_s / updates if updates else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end PIR lookups over a loopback DHT")
+    parser.add_argument("--nodes", type=int, default=16)
+    parser.add_argument("--clients", type=int, default=4, help="concurrent lookup clients")
+    parser.add_argument("--lookups", type=int, default=8, help="lookups per client")
+    parser.add_argument("--bucket-size", type=int, default=4, help="contacts per k-bucket (row)")
+    parser.add_argument("--key-bits", type=int, default=1024, help="modulus size of each client's key")
+    parser.add_argument("--s", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=None, help="answering processes shared by all nodes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-window-ms", type=float, nargs="*", default=[0.0],
+                        help="how long a server collects queries into one batch (0: no batching); "
+                             "several values run one simulation each, to compare latency and throughput")
+    parser.add_argument("--max-batch", type=int, default=16, help="answer a batch as soon as it has this many queries")
+    parser.add_argument("--preprocess", type=int, default=0,
+                        help="precompute this many queries per client and node before timing lookups")
+    parser.add_argument("--churn", type=float, default=0.0,
+                        help="change this many buckets per second while the lookups run (inf: as fast as possible)")
+    parser.add_argument("--output", default=None, help="also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = [asyncio.run(simulate(args.nodes, args.clients, args.lookups, args.bucket_size, args.key_bits,
+                                    args.s, args.workers, args.seed, window / 1000, args.max_batch,
+                                    args.preprocess, args.churn))
+               for window in args.batch_window_ms]
+    if len(results) == 1:
+        results = results[0]
+    else:
+        print(f"{'window (ms)':>12} {'batch':>6} {'latency p50 (s)':>16} {'p95 (s)':>8} {'queries/s':>10} "
+              f"{'updates/s':>10}", file=sys.stderr)
+        for r in results:
+            print(f"{1000 * r['batch_window_s']:>12g} {r['batch_size_mean']:>6.2f} {r['latency_median_s']:>16.3f} "
+                  f"{r['latency_p95_s']:>8.3f} {r['queries_per_s']:>10.2f} {r['updates_per_s']:>10.1f}",
+                  file=sys.stderr)
+    json.dump(results, sys.stdout, indent=4)
+    print()
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
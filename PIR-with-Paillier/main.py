@@ -1,8 +1,13 @@
 from paillier import *
+from pir import encrypt_selection, dot
+import sys
 import time
 
 if __name__=='__main__':
 
+    num_rows = 256
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else None
+
     # Measure keygen time
     start = time.time()
     pk, sk = Paillier.keygen(1024)
@@ -11,18 +16,15 @@ if __name__=='__main__':
 
     # Measure encryption time
     start = time.time()
-    messages = [(1 if i==14 else 0) for i in range(256)]
-    ciphertexts = [pk.encrypt([messages[i]]) for i in range(256)]
+    ciphertexts = encrypt_selection(pk, 14, num_rows, workers=workers)
     end = time.time()
     print(f"Encryption time: {end - start}")
     
-    database = [i for i in range(256)]
+    database = [i for i in range(num_rows)]
 
     # Measure decryption time
     start = time.time()
-    ciphertext_sum = pk.encrypt([0])
-    for i in range(256):
-        ciphertext_sum = ciphertext_sum + (ciphertexts[i] * database[i])
+    ciphertext_sum = dot(ciphertexts, database, workers=workers)
     end = time.time()
     print(f"Computation time: {end - start}")
 
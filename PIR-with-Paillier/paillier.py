@@ -7,8 +7,8 @@ class PaillierCiphertext(DamgardCiphertext):
 
 
 class PaillierSecretKey(DamgardSecretKey):
-    def __init__(self, n, phi):
-        super().__init__(n, 1, phi)
+    def __init__(self, n, phi, p=None, q=None):
+        super().__init__(n, 1, phi, p, q)
 
 
 class PaillierPublicKey(DamgardPublicKey):
@@ -24,12 +24,12 @@ class Paillier:
     @staticmethod
     def keygen(bits):
         """Generate Damgard-Jurik key pair."""
-        p = getPrime(bits)
-        q = getPrime(bits)
+        p = backend.current.get_prime(bits)
+        q = backend.current.get_prime(bits)
         n = p * q
         g = n + 1
         phi = (p - 1) * (q - 1)
-        return PaillierPublicKey(n, g), PaillierSecretKey(n, phi)
+        return PaillierPublicKey(n, g), PaillierSecretKey(n, phi, p, q)
 
 
 if __name__ == "__main__":
@@ -40,5 +40,6 @@ if __name__ == "__main__":
     ciphertext2 = pk.encrypt(message2)
     ciphertext_sum = ciphertext2 + ciphertext1
     decrypted_sum = sk.decrypt(ciphertext_sum)
+    assert decrypted_sum == sk.decrypt(ciphertext_sum, use_crt=False)
     plaintext_sum = [messages[i] + message2[i] for i in range(len(messages))]
     print(f"Sum of original messages: {plaintext_sum}, Decrypted sum: {decrypted_sum}")
@@ -0,0 +1,222 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+from damgard import *
+from database import MmapDatabase, Packing
+
+
+def shards(count: int, workers: int) -> List[Tuple[int, int]]:
+    """Split range(count) into at most workers contiguous (start, stop) slices of near-equal size."""
+    workers = max(1, min(workers, count))
+    size, extra = divmod(count, workers)
+    bounds = []
+    start = 0
+    for i in range(workers):
+        stop = start + size + (1 if i < extra else 0)
+        bounds.append((start, stop))
+        start = stop
+    return bounds
+
+
+def _encrypt_shard(n, s, messages):
+    return DamgardPublicKey(n, n + 1).encrypt(messages, s).values
+
+
+def _dot_shard(nsp1, values, database):
+    return Damgard.multi_exp(values, database, nsp1)
+
+
+def _map_shards(fn, jobs, workers):
+    if workers == 1 or len(jobs) == 1:
+        return [fn(*job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(fn, *job) for job in jobs]
+        return [f.result() for f in futures]
+
+
+def encrypt_vector(pk, messages, s=1, workers=None):
+    """Encrypt a whole vector of messages, sharding the work across worker processes."""
+    workers = workers or os.cpu_count()
+    if pk.g != pk.n + 1:
+        return pk.encrypt(messages, s)
+    jobs = [(pk.n, s, messages[start:stop]) for start, stop in shards(len(messages), workers)]
+    values = [v for part in _map_shards(_encrypt_shard, jobs, workers) for v in part]
+    return DamgardCiphertext(pk.n, pk.g, s, values)
+
+
+def encrypt_selection(pk, index, num_rows, s=1, workers=None):
+    """Encrypt the BasicPIR query for row index: a one-hot vector of length num_rows."""
+    return encrypt_vector(pk, [int(i == index) for i in range(num_rows)], s, workers)
+
+
+def dot(query, database, workers=None):
+    """Compute the encrypted dot product of query with a plaintext database column.
+
+    Each worker reduces its shard to a single partial product, and the partials are
+    multiplied together here, so only one ciphertext per shard crosses process boundaries.
+    """
+    assert len(query.values) == len(database), "query and database have different lengths"
+    workers = workers or os.cpu_count()
+    nsp1 = query.ns * query.n
+    jobs = [(nsp1, query.values[start:stop], database[start:stop])
+            for start, stop in shards(len(database), workers)]
+    acc = 1
+    for partial in _map_shards(_dot_shard, jobs, workers):
+        acc = acc * partial % nsp1
+    return DamgardCiphertext(query.n, query.g, query.s, [acc], ns=query.ns)
+
+
+def _answer_shard(path, row_size, num_rows, nsp1, packing, values, start, stop, block_rows):
+    with MmapDatabase(path, row_size, num_rows=num_rows) as db:
+        acc = [1] * packing.num_plaintexts(row_size)
+        for first, columns in db.blocks(packing, start, stop, block_rows):
+            selection = values[first - start:first - start + len(columns[0])]
+            for j, column in enumerate(columns):
+                acc[j] = acc[j] * Damgard.multi_exp(selection, column, nsp1) % nsp1
+        return acc
+
+
+def answer_database(query, db, packing=None, workers=None, block_rows=1024):
+    """Answer a BasicPIR query over an MmapDatabase, returning one ciphertext per packed plaintext.
+
+    Rows are encoded with packing (by default Packing.for_rows(n, s, row_size)) and decoded
+    on the client with packing.decode. The query has one element per record of the
+    packing (see Packing.rows_per_plaintext). Records are streamed in blocks of
+    block_rows, so the server's working set is bounded by the block size rather than the
+    database size. Each worker maps the file itself and reduces its shard of records to
+    one partial product per plaintext.
+    """
+    packing = Packing.for_rows(query.n, query.s, db.row_size) if packing is None else packing
+    num_records = db.num_records(packing)
+    assert len(query.values) == num_records, "query and database have different lengths"
+    workers = workers or os.cpu_count()
+    nsp1 = query.ns * query.n
+    jobs = [(db.path, db.row_size, db.num_rows, nsp1, packing, query.values[start:stop], start, stop, block_rows)
+            for start, stop in shards(num_records, workers)]
+    acc = [1] * packing.num_plaintexts(db.row_size)
+    for partial in _map_shards(_answer_shard, jobs, workers):
+        acc = [a * b % nsp1 for a, b in zip(acc, partial)]
+    return DamgardCiphertext(query.n, query.g, query.s, acc, ns=query.ns)
+
+
+def _record_range(packing, row_size, start, stop):
+    """The records of packing whose first row is in rows start..stop, so row shards split records exactly."""
+    k = packing.rows_per_plaintext(row_size)
+    return -(-start // k), -(-stop // k)
+
+
+def _answer_batch_shard(path, row_size, num_rows, queries, start, stop, block_rows):
+    """Answer several queries, given as (nsp1, packing, values), over rows start..stop in one pass.
+
+    Each query's values cover its records in _record_range(packing, row_size, start, stop).
+    Queries whose packings lay rows out the same way share the encoded columns of each
+    block of records and the digit decomposition of each column, so only the bucket
+    multiplications are paid per query.
+    """
+    groups = {}
+    for q, (nsp1, packing, values) in enumerate(queries):
+        groups.setdefault((packing.slot_bits, packing.slots), []).append(q)
+    accs = [[1] * packing.num_plaintexts(row_size) for _, packing, _ in queries]
+    with MmapDatabase(path, row_size, num_rows=num_rows) as db:
+        for members in groups.values():
+            packing = queries[members[0]][1]
+            first_record, stop_record = _record_range(packing, row_size, start, stop)
+            moduli = [queries[q][0] for q in members]
+            for first, columns in db.blocks(packing, first_record, stop_record, block_rows):
+                offset = first - first_record
+                selections = [queries[q][2][offset:offset + len(columns[0])] for q in members]
+                for j, column in enumerate(columns):
+                    for q, value in zip(members, Damgard.multi_exp_batch(selections, column, moduli)):
+                        accs[q][j] = accs[q][j] * value % queries[q][0]
+    return accs
+
+
+def answer_database_batch(queries, db, workers=None, block_rows=1024):
+    """Answer several BasicPIR queries over an MmapDatabase in a single streaming pass.
+
+    Like answer_database, but each block of records is loaded, packed and decomposed into
+    exponent digits once for the whole batch rather than once per query. Queries may come
+    from different keys; each is packed with its own Packing.for_rows(n, s, row_size).
+    """
+    workers = workers or os.cpu_count()
+    specs = [(query.ns * query.n, Packing.for_rows(query.n, query.s, db.row_size), query.values)
+             for query in queries]
+    for _, packing, values in specs:
+        assert len(values) == db.num_records(packing), "query and database have different lengths"
+    jobs = [(db.path, db.row_size, db.num_rows,
+             [(nsp1, packing, values[slice(*_record_range(packing, db.row_size, start, stop))])
+              for nsp1, packing, values in specs],
+             start, stop, block_rows)
+            for start, stop in shards(db.num_rows, workers)]
+    accs = [[1] * packing.num_plaintexts(db.row_size) for _, packing, _ in specs]
+    for partial in _map_shards(_answer_batch_shard, jobs, workers):
+        for q, (nsp1, _, _) in enumerate(specs):
+            accs[q] = [a * b % nsp1 for a, b in zip(accs[q], partial[q])]
+    return [DamgardCiphertext(query.n, query.g, query.s, acc, ns=query.ns) for query, acc in zip(queries, accs)]
+
+
+def _fold_shard(nsp1, selection, blocks):
+    return [Damgard.multi_exp(selection, block, nsp1) for block in blocks]
+
+
+class HypercubePIR:
+    """d-dimensional PIR with recursive Damgard-Jurik layering.
+
+    The database is laid out as a side x ... x side hypercube with side = ceil(N^(1/d)),
+    where row i sits at coordinates (i % side, (i // side) % side, ...). The query holds
+    one encrypted selection vector of length side per dimension, the j-th one under level
+    s + j. The server folds the first dimension under level s, then uses the resulting
+    level-s ciphertexts (which are < n^(s+1)) as plaintexts for the fold under level
+    s + 1, and so on, ending with a single ciphertext under level s + d - 1. The query is
+    O(d * N^(1/d)) ciphertexts instead of O(N).
+    """
+
+    def __init__(self, num_rows, d=2, s=1):
+        self.num_rows = num_rows
+        self.d = d
+        self.s = s
+        side = max(1, round(num_rows ** (1 / d)))
+        while side ** d < num_rows:
+            side += 1
+        while side > 1 and (side - 1) ** d >= num_rows:
+            side -= 1
+        self.side = side
+
+    def coordinates(self, index):
+        return [(index // self.side ** j) % self.side for j in range(self.d)]
+
+    def query(self, pk, index, workers=None):
+        assert 0 <= index < self.num_rows, "index out of range"
+        return [encrypt_selection(pk, coordinate, self.side, s=self.s + j, workers=workers)
+                for j, coordinate in enumerate(self.coordinates(index))]
+
+    def answer(self, query, database, workers=None):
+        """Answer query over a list of plaintexts, each smaller than n^s."""
+        assert len(query) == self.d, "query has the wrong number of dimensions"
+        assert len(database) <= self.side ** self.d, "database is larger than the hypercube"
+        workers = workers or os.cpu_count()
+        side = self.side
+        level = list(database) + [0] * (side ** self.d - len(database))
+        for selection in query:
+            nsp1 = selection.ns * selection.n
+            blocks = [level[start:start + side] for start in range(0, len(level), side)]
+            jobs = [(nsp1, selection.values, blocks[start:stop])
+                    for start, stop in shards(len(blocks), workers)]
+            level = [c for part in _map_shards(_fold_shard, jobs, workers) for c in part]
+        last = query[-1]
+        return DamgardCiphertext(last.n, last.g, last.s, level, ns=last.ns)
+
+    def decode(self, sk, reply):
+        """Peel the layers of reply from level s + d - 1 down to level s."""
+        value = reply.values[0]
+        for level in range(self.s + self.d - 1, self.s - 1, -1):
+            value = sk.decrypt(DamgardCiphertext(reply.n, reply.g, level, [value]))[0]
+        return value
+
+    def query_bits(self, modulus_bits):
+        """Size of a query in bits: side ciphertexts of (s + j + 1) * log2(n) bits per dimension j."""
+        return sum(self.side * (self.s + j + 1) * modulus_bits for j in range(self.d))
+
+    def reply_bits(self, modulus_bits):
+        return (self.s + self.d) * modulus_bits
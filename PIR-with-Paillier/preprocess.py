@@ -0,0 +1,128 @@
+import json
+import os
+import shutil
+import threading
+import urllib.parse
+import uuid
+
+import backend
+from damgard import *
+
+
+class QueryStore:
+    """On-disk cache of a PIR client's key pair and precomputed query material.
+
+    A BasicPIR query is num_rows encryptions of 0 except for a 1 at the wanted index.
+    Under g = n + 1 an encryption of 0 is just a noise value r^(n^s), and turning it into
+    an encryption of 1 costs one multiplication by n + 1. So the store keeps whole
+    pre-encrypted zero vectors, computed offline by prepare(), and query() only patches
+    the one index-dependent element. Each vector is used for exactly one query and then
+    deleted: reusing one would let the server see which element changed.
+
+    num_rows below is the length of the query, i.e. the number of records of the packing
+    the server uses (see database.Packing.num_records), which can be less than the
+    database's number of rows.
+
+    Vectors are kept per server and per database epoch. When sync() sees a new epoch for a
+    server, that server's vectors are dropped, since the database (and possibly its size)
+    changed. The key pair is shared by all servers and written with owner-only permissions.
+
+    Layout under root:
+        key-{bits}.json                         p and q of the key pair (hex)
+        servers/{server}/epoch                  epoch the vectors below were made for
+        servers/{server}/{num_rows}-{s}/{k}.bin CiphertextVector buffers, one per query
+    """
+
+    def __init__(self, root, key_bits=1024):
+        self.root = root
+        self.key_bits = key_bits
+        self._keys = None
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(root, "servers"), exist_ok=True)
+
+    def keypair(self):
+        """The stored key pair, generated and persisted on first use."""
+        with self._lock:
+            if self._keys is None:
+                self._keys = self._load_keypair()
+            return self._keys
+
+    def _load_keypair(self):
+        path = os.path.join(self.root, f"key-{self.key_bits}.json")
+        if os.path.exists(path):
+            with open(path) as f:
+                key = {name: backend.current.mpz(int(value, 16)) for name, value in json.load(f).items()}
+            p, q = key["p"], key["q"]
+            pk = DamgardPublicKey(p * q, p * q + 1)
+            sk = DamgardSecretKey(p * q, 1, lcm(p - 1, q - 1), p, q)
+        else:
+            pk, sk = Damgard.keygen(self.key_bits // 2, s=1)
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                json.dump({"p": format(int(sk.p), "x"), "q": format(int(sk.q), "x")}, f)
+        return pk, sk
+
+    def _server_dir(self, server):
+        return os.path.join(self.root, "servers", urllib.parse.quote(str(server), safe=""))
+
+    def _vector_dir(self, server, num_rows, s):
+        return os.path.join(self._server_dir(server), f"{num_rows}-{s}")
+
+    def sync(self, server, epoch):
+        """Record the server's current database epoch, dropping material made for an older one."""
+        server_dir = self._server_dir(server)
+        epoch_file = os.path.join(server_dir, "epoch")
+        with self._lock:
+            if os.path.exists(epoch_file):
+                with open(epoch_file) as f:
+                    if f.read().strip() == str(epoch):
+                        return
+                shutil.rmtree(server_dir)
+            os.makedirs(server_dir, exist_ok=True)
+            with open(epoch_file, "w") as f:
+                f.write(str(epoch))
+
+    def available(self, server, num_rows, s=1):
+        directory = self._vector_dir(server, num_rows, s)
+        return sum(name.endswith(".bin") for name in os.listdir(directory)) if os.path.isdir(directory) else 0
+
+    def prepare(self, server, num_rows, count, s=1):
+        """Offline: encrypt count zero vectors of num_rows elements for queries to server."""
+        pk, _ = self.keypair()
+        ctx = DamgardContext(pk.n, s)
+        directory = self._vector_dir(server, num_rows, s)
+        os.makedirs(directory, exist_ok=True)
+        for _ in range(count):
+            noise = [Damgard.noise_single(ctx.n, ctx.ns, ctx.nsp1) for _ in range(num_rows)]
+            vector = CiphertextVector.from_values(ctx, noise)
+            name = uuid.uuid4().hex
+            # Written under a temporary name so that a crash never leaves a torn vector
+            tmp = os.path.join(directory, f".{name}.tmp")
+            with open(tmp, "wb") as f:
+                f.write(vector.buffer)
+            os.replace(tmp, os.path.join(directory, f"{name}.bin"))
+
+    def take(self, server, num_rows, s=1):
+        """Remove and return one stored zero vector, or None if none is left."""
+        pk, _ = self.keypair()
+        directory = self._vector_dir(server, num_rows, s)
+        with self._lock:
+            names = sorted(name for name in os.listdir(directory) if name.endswith(".bin")) \
+                if os.path.isdir(directory) else []
+            if not names:
+                return None
+            path = os.path.join(directory, names[0])
+            with open(path, "rb") as f:
+                buffer = bytearray(f.read())
+            os.unlink(path)
+        return CiphertextVector(DamgardContext(pk.n, s), buffer=buffer)
+
+    def query(self, server, index, num_rows, s=1):
+        """The BasicPIR query for row index, from stored material when there is any."""
+        pk, _ = self.keypair()
+        vector = self.take(server, num_rows, s)
+        if vector is None:
+            return pk.encrypt([int(i == index) for i in range(num_rows)], s)
+        # Enc(0) * (n + 1) = Enc(1)
+        vector[index] = vector[index] * (pk.n + 1) % vector.ctx.nsp1
+        return vector.to_ciphertext()
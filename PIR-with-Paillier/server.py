@@ -0,0 +1,402 @@
+import asyncio
+import contextlib
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from damgard import *
+from database import Packing
+from pir import _answer_batch_shard, _answer_shard, encrypt_selection
+from wire import WireError, decode_query, decode_vector, encode_query, encode_stream
+
+# Wire protocol: every message is a frame of a 4-byte little-endian payload length
+# followed by the payload, whose first byte is the message type.
+#
+#   INFO     client -> server: empty
+#            server -> client: num_rows (u32), row_size (u32), epoch (u64), version (u64)
+#   QUERY    client -> server: version (u64) the client last saw, slot_bits (u32) of the
+#                              client's Packing (0: Packing.for_rows's choice), then a
+#                              query in the encoding of wire.encode_query
+#            server -> client: version (u64) of the database the answer was computed over,
+#                              then the answer as a wire vector, one ciphertext per packed plaintext;
+#                              a query made before the latest insert or delete gets an ERROR
+#   ERROR    server -> client: UTF-8 message
+MSG_INFO = 0x01
+MSG_QUERY = 0x02
+MSG_ERROR = 0xFF
+
+FRAME = struct.Struct("<I")
+INFO = struct.Struct("<IIQQ")
+VERSION = struct.Struct("<Q")
+QUERY = struct.Struct("<QI")
+MAX_FRAME = 1 << 30
+
+
+class ProtocolError(Exception):
+    pass
+
+
+async def read_frame(reader):
+    """Read one frame; return (message type, body), or None at a clean end of stream."""
+    try:
+        header = await reader.readexactly(FRAME.size)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise ProtocolError("connection closed inside a frame header")
+        return None
+    (length,) = FRAME.unpack(header)
+    if not 1 <= length <= MAX_FRAME:
+        raise ProtocolError(f"invalid frame length {length}")
+    payload = await reader.readexactly(length)
+    return payload[0], memoryview(payload)[1:]
+
+
+def write_frame(writer, kind, *parts):
+    length = 1 + sum(len(part) for part in parts)
+    writer.write(FRAME.pack(length) + bytes([kind]))
+    for part in parts:
+        writer.write(part)
+
+
+def _answer(path, row_size, num_rows, n, s, slot_bits, values, block_rows):
+    """Answer a BasicPIR query in a worker process, over the whole database at path."""
+    packing = Packing.for_rows(n, s, row_size, slot_bits)
+    num_records = packing.num_records(num_rows, row_size)
+    return _answer_shard(path, row_size, num_rows, n ** (s + 1), packing, values, 0, num_records, block_rows)
+
+
+def _answer_batch(path, row_size, num_rows, queries, block_rows):
+    """Answer a batch of (n, s, slot_bits, values) queries in a worker process, in one pass over the database."""
+    specs = [(n ** (s + 1), Packing.for_rows(n, s, row_size, slot_bits), values)
+             for n, s, slot_bits, values in queries]
+    return _answer_batch_shard(path, row_size, num_rows, specs, 0, num_rows, block_rows)
+
+
+class PIRServer:
+    """Serves BasicPIR queries over an MmapDatabase on an asyncio TCP socket.
+
+    Answers are computed in a process pool (shared between servers when executor is
+    given), so the event loop keeps accepting and reading queries while earlier ones are
+    being answered, and up to `workers` queries are answered in parallel. Rows are packed
+    with Packing.for_rows(n, s, row_size, slot_bits) of the client's key and slot width,
+    so a query has one element per record of rows sharing a plaintext.
+
+    With batch_window_s, a query waits up to that long for others to arrive (or until
+    max_batch are pending), and the whole batch is answered in one pass over the database
+    (see answer_database_batch). This trades the wait for throughput; the batches, waits and
+    service times are counted in metrics().
+
+    epoch identifies the database contents to clients, which drop their precomputed query
+    material when it changes (see preprocess.QueryStore). By default it is the database
+    file's modification time in nanoseconds.
+
+    With a writable database, update() changes rows while the server runs. Changes wait
+    for the queries being answered to finish and hold back new ones meanwhile, since a
+    worker must never see a row half-written or the file shrink under it. Every change
+    bumps the database version, which INFO and every answer report. A query carries the
+    version its client last saw and is refused if rows were inserted or deleted since, as
+    those change the number of records and move rows to other indices; changes made by
+    modify keep every row where it was, so queries from before them are still answered.
+    Precomputed query material only depends on the number of rows, so it survives
+    changes of version.
+    """
+
+    def __init__(self, db, executor=None, workers=None, block_rows=1024, batch_window_s=0.0, max_batch=16,
+                 epoch=None):
+        self.db = db
+        self.epoch = os.stat(db.path).st_mtime_ns if epoch is None else epoch
+        self.block_rows = block_rows
+        self.batch_window_s = batch_window_s
+        self.max_batch = max_batch
+        self._own_executor = executor is None
+        self.executor = ProcessPoolExecutor(max_workers=workers or os.cpu_count()) if executor is None else executor
+        self._server = None
+        self._connections = {}
+        self._pending = []
+        self._flush_handle = None
+        self._batches_in_flight = set()
+        self._state = asyncio.Condition()
+        self._readers = 0
+        self._writing = False
+        # Version of the latest insert or delete, before which queries are refused
+        self._layout_version = db.version
+        self.queries = 0
+        self.updates = 0
+        self.update_s = 0.0
+        self.batches = 0
+        self.busy_s = 0.0
+        self.wait_s = 0.0
+
+    @property
+    def port(self):
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self, host="127.0.0.1", port=0):
+        self._server = await asyncio.start_server(self._serve, host, port)
+        return self.port
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            # Closing the sockets ends every handler with an end of stream instead of
+            # leaving them to be cancelled when the event loop shuts down
+            for writer in list(self._connections):
+                writer.close()
+            await asyncio.gather(*self._connections.values(), return_exceptions=True)
+            await self._server.wait_closed()
+        if self._own_executor:
+            self.executor.shutdown()
+
+    @property
+    def version(self):
+        return self.db.version
+
+    @contextlib.asynccontextmanager
+    async def _reading(self):
+        async with self._state:
+            await self._state.wait_for(lambda: not self._writing)
+            self._readers += 1
+        try:
+            yield
+        finally:
+            async with self._state:
+                self._readers -= 1
+                self._state.notify_all()
+
+    async def update(self, modify=(), insert=(), delete=()):
+        """Change rows between queries; return {old index: new index} of rows moved by deletes.
+
+        modify is (index, row) pairs, applied first. delete is indices, applied from the
+        highest down, each moving the current last row into the gap (see
+        MmapDatabase.delete). insert is rows appended at the end. Indices refer to the
+        database as it was before the call. Every index and row is checked before the
+        first change, so a call that raises leaves the database as it was.
+        """
+        moved = {}
+        async with self._state:
+            await self._state.wait_for(lambda: not self._writing)
+            self._writing = True
+            try:
+                for i in [i for i, _ in modify] + list(delete):
+                    if not 0 <= i < self.db.num_rows:
+                        raise IndexError(f"row {i} out of range")
+                for row in [row for _, row in modify] + list(insert):
+                    self.db._check_row(row)
+                await self._state.wait_for(lambda: self._readers == 0)
+                start = time.perf_counter()
+                for i, row in modify:
+                    self.db.update(i, row)
+                # Current index -> index before the call, for rows moved so far
+                position = {}
+                for i in sorted(set(delete), reverse=True):
+                    moved.pop(position.pop(i, i), None)
+                    last = self.db.num_rows - 1
+                    if self.db.delete(i) is not None:
+                        original = position.pop(last, last)
+                        moved[original] = i
+                        position[i] = original
+                for row in insert:
+                    self.db.insert(row)
+                if delete or insert:
+                    self._layout_version = self.version
+                self.updates += len(modify) + len(delete) + len(insert)
+                self.update_s += time.perf_counter() - start
+            finally:
+                self._writing = False
+                self._state.notify_all()
+        return moved
+
+    def metrics(self):
+        return {
+            "queries": self.queries,
+            "updates": self.updates,
+            "update_s": self.update_s,
+            "version": self.version,
+            "batches": self.batches,
+            "batch_size_mean": self.queries / self.batches if self.batches else None,
+            "busy_s": self.busy_s,
+            "wait_s_mean": self.wait_s / self.queries if self.queries else None,
+        }
+
+    async def answer(self, query, slot_bits=None):
+        num_records = self.db.num_records(Packing.for_rows(query.n, query.s, self.db.row_size, slot_bits))
+        if len(query.values) != num_records:
+            raise ProtocolError(f"query has {len(query.values)} ciphertexts, database has {num_records} records")
+        loop = asyncio.get_running_loop()
+        if self.batch_window_s <= 0 or self.max_batch <= 1:
+            start = time.perf_counter()
+            values = await loop.run_in_executor(self.executor, _answer, self.db.path, self.db.row_size,
+                                                self.db.num_rows, query.n, query.s, slot_bits, query.values,
+                                                self.block_rows)
+            self.busy_s += time.perf_counter() - start
+            self.queries += 1
+            self.batches += 1
+            return DamgardCiphertext(query.n, query.g, query.s, values, ns=query.ns)
+
+        future = loop.create_future()
+        self._pending.append((query, slot_bits, future, time.perf_counter()))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window_s, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._answer_batch(batch))
+            self._batches_in_flight.add(task)
+            task.add_done_callback(self._batches_in_flight.discard)
+
+    async def _answer_batch(self, batch):
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            results = await loop.run_in_executor(
+                self.executor, _answer_batch, self.db.path, self.db.row_size, self.db.num_rows,
+                [(query.n, query.s, slot_bits, query.values) for query, slot_bits, _, _ in batch], self.block_rows)
+        except Exception as e:
+            for _, _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.busy_s += time.perf_counter() - start
+        self.batches += 1
+        self.queries += len(batch)
+        for (query, _, future, arrived), values in zip(batch, results):
+            self.wait_s += start - arrived
+            if not future.done():
+                future.set_result(DamgardCiphertext(query.n, query.g, query.s, values, ns=query.ns))
+
+    async def _serve(self, reader, writer):
+        self._connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                frame = await read_frame(reader)
+                if frame is None:
+                    break
+                kind, body = frame
+                try:
+                    if kind == MSG_INFO:
+                        write_frame(writer, MSG_INFO,
+                                    INFO.pack(self.db.num_rows, self.db.row_size, self.epoch, self.version))
+                    elif kind == MSG_QUERY:
+                        if len(body) < QUERY.size:
+                            raise ProtocolError("truncated query")
+                        seen, slot_bits = QUERY.unpack_from(body)
+                        query = decode_query(body[QUERY.size:]).to_ciphertext()
+                        async with self._reading():
+                            if seen < self._layout_version:
+                                raise ProtocolError(f"rows were inserted or deleted at version {self._layout_version}, "
+                                                    f"after the client's version {seen}; refresh and retry")
+                            reply = await self.answer(query, slot_bits or None)
+                            version = self.version
+                        write_frame(writer, MSG_QUERY, VERSION.pack(version), *encode_stream(reply))
+                    else:
+                        raise ProtocolError(f"unknown message type {kind}")
+                except (ProtocolError, WireError) as e:
+                    write_frame(writer, MSG_ERROR, str(e).encode())
+                except Exception as e:
+                    # Anything else that goes wrong answering (e.g. a modulus too small to
+                    # pack a row, or a broken worker pool) fails this request, not the connection
+                    write_frame(writer, MSG_ERROR, f"{type(e).__name__}: {e}".encode())
+                await writer.drain()
+        except (ProtocolError, ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            del self._connections[writer]
+            writer.close()
+
+
+class PIRClient:
+    """Retrieves rows from a PIRServer without revealing which.
+
+    One connection carries one request at a time. Query encryption and reply decryption
+    run in the default thread pool so other clients on the same event loop are not
+    blocked for their whole duration.
+
+    With a store (a preprocess.QueryStore holding this client's key pair), queries use
+    its precomputed zero vectors for server, so the online work is a single
+    multiplication; the store is synced with the server's epoch on connect.
+
+    version is the database version of the latest INFO or answer, and is sent with every
+    query. The server refuses queries made before rows were inserted or deleted, since
+    num_rows and the row indices have changed; retrieve() then raises ProtocolError, and
+    refresh() followed by a retry gets the current row.
+
+    slot_bits sets the slot width of the client's Packing, which every query tells the
+    server; by default Packing.for_rows chooses it.
+    """
+
+    def __init__(self, pk, sk, s=1, store=None, server=None, slot_bits=None):
+        self.pk = pk
+        self.sk = sk
+        self.s = s
+        self.store = store
+        self.server = server
+        self.slot_bits = slot_bits
+        self.num_rows = None
+        self.row_size = None
+        self.packing = None
+        self.epoch = None
+        self.version = None
+        self._reader = None
+        self._writer = None
+
+    async def connect(self, host="127.0.0.1", port=0):
+        self._reader, self._writer = await asyncio.open_connection(host, port)
+        if self.store is not None and self.server is None:
+            self.server = f"{host}:{port}"
+        return await self.refresh()
+
+    async def refresh(self):
+        """Fetch the database's current size, epoch and version."""
+        body = await self._request(MSG_INFO)
+        self.num_rows, self.row_size, self.epoch, self.version = INFO.unpack(body)
+        self.packing = Packing.for_rows(self.pk.n, self.s, self.row_size, self.slot_bits)
+        if self.store is not None:
+            self.store.sync(self.server, self.epoch)
+        return self
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            await self._writer.wait_closed()
+
+    async def _request(self, kind, *parts):
+        write_frame(self._writer, kind, *parts)
+        await self._writer.drain()
+        frame = await read_frame(self._reader)
+        if frame is None:
+            raise ProtocolError("server closed the connection")
+        reply_kind, body = frame
+        if reply_kind == MSG_ERROR:
+            raise ProtocolError(bytes(body).decode())
+        if reply_kind != kind:
+            raise ProtocolError(f"expected message type {kind}, got {reply_kind}")
+        return body
+
+    async def retrieve(self, index):
+        """Fetch row index as bytes."""
+        loop = asyncio.get_running_loop()
+        # The query selects the record holding the row (see Packing.rows_per_plaintext)
+        record = index // self.packing.rows_per_plaintext(self.row_size)
+        num_records = self.packing.num_records(self.num_rows, self.row_size)
+        if self.store is not None:
+            query = await loop.run_in_executor(None, self.store.query, self.server, record, num_records, self.s)
+        else:
+            query = await loop.run_in_executor(None, encrypt_selection, self.pk, record, num_records, self.s, 1)
+        body = await self._request(MSG_QUERY, QUERY.pack(self.version, self.slot_bits or 0), *encode_query(query))
+        if len(body) < VERSION.size:
+            raise ProtocolError("truncated answer")
+        (self.version,) = VERSION.unpack_from(body)
+        try:
+            reply = decode_vector(body[VERSION.size:], self.pk.n).to_ciphertext()
+        except WireError as e:
+            raise ProtocolError(str(e))
+        plaintexts = await loop.run_in_executor(None, self.sk.decrypt, reply)
+        return self.packing.decode(plaintexts, self.row_size, index)
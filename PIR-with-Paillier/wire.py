@@ -0,0 +1,210 @@
+import hashlib
+import struct
+
+import backend
+from damgard import *
+
+# Binary encoding of Damgard-Jurik ciphertext vectors. Everything is little-endian.
+#
+#   vector  header, then count ciphertexts of exactly width(n, s) bytes each, which is
+#           the CiphertextVector buffer as is
+#   header  magic "DJ", version (u8), fingerprint of n (8 bytes), s (u16), count (u32)
+#   query   n_len (u16), n (n_len bytes), vector; the server learns n from the query
+#   reply   vector; the client checks the fingerprint against its own n
+#
+# So a vector of count ciphertexts takes HEADER.size + count * width(n, s) bytes, with
+# width(n, s) = ceil(log2(n^(s+1)) / 8), i.e. 2 * 256 bytes per ciphertext for a
+# 2048-bit n at s = 1, as bpail() in pir-compare.py assumes.
+MAGIC = b"DJ"
+VERSION = 1
+HEADER = struct.Struct("<2sB8sHI")
+N_LEN = struct.Struct("<H")
+# A peer chooses n and s, and decoding computes n^s, so both are bounded before that
+MAX_S = 16
+MAX_N_BYTES = 1024
+
+
+class WireError(ValueError):
+    pass
+
+
+def fingerprint(n):
+    n = int(n)
+    return hashlib.sha256(n.to_bytes((n.bit_length() + 7) // 8, "little")).digest()[:8]
+
+
+def encoded_size(ctx, count):
+    return HEADER.size + count * ctx.width
+
+
+def _as_vector(ct):
+    if isinstance(ct, CiphertextVector):
+        return ct
+    assert ct.g == ct.n + 1, "only the standard generator g = n + 1 can be encoded"
+    return ct.to_vector()
+
+
+def encode_vector(ct):
+    """Encode a CiphertextVector (or DamgardCiphertext) as a list of bytes-like parts.
+
+    The parts are the header and the vector's own buffer, so nothing is copied; pass them
+    to writer.write / writelines, or join them.
+    """
+    vector = _as_vector(ct)
+    ctx = vector.ctx
+    return [HEADER.pack(MAGIC, VERSION, fingerprint(ctx.n), ctx.s, len(vector)), memoryview(vector.buffer)]
+
+
+def parse_header(data, n=None):
+    """(s, count) from the header at the start of data, checked against n when given."""
+    if len(data) < HEADER.size:
+        raise WireError("truncated ciphertext header")
+    magic, version, print_, s, count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise WireError(f"not a version {VERSION} ciphertext vector")
+    if not 1 <= s <= MAX_S:
+        raise WireError(f"s must be between 1 and {MAX_S}, got {s}")
+    if n is not None and print_ != fingerprint(n):
+        raise WireError("ciphertexts were made under a different modulus n")
+    return s, count
+
+
+def decode_vector(data, n):
+    """Decode a vector under modulus n from data without copying the ciphertexts.
+
+    The returned CiphertextVector's buffer is a memoryview into data, so data must stay
+    alive (and be writable, e.g. a bytearray, if the vector is to be modified in place).
+    """
+    s, count = parse_header(data, n)
+    # n^(s+1) has between (s+1)(b-1)+1 and (s+1)b bits for a b-bit n, which bounds the
+    # width without computing the power
+    bits = int(n).bit_length()
+    body = len(data) - HEADER.size
+    if not count * -(-((s + 1) * (bits - 1) + 1) // 8) <= body <= count * -(-(s + 1) * bits // 8):
+        raise WireError(f"{body} bytes can't hold {count} ciphertexts at s = {s}")
+    ctx = DamgardContext(n, s)
+    if len(data) != encoded_size(ctx, count):
+        raise WireError(f"expected {count} ciphertexts of {ctx.width} bytes")
+    return CiphertextVector(ctx, buffer=memoryview(data)[HEADER.size:])
+
+
+def encode_query(ct):
+    vector = _as_vector(ct)
+    n = int(vector.ctx.n)
+    n_bytes = n.to_bytes((n.bit_length() + 7) // 8, "little")
+    return [N_LEN.pack(len(n_bytes)), n_bytes] + encode_vector(vector)
+
+
+def decode_query(data):
+    """Decode a query (n followed by a vector) without copying its ciphertexts."""
+    if len(data) < N_LEN.size:
+        raise WireError("truncated query")
+    (n_len,) = N_LEN.unpack_from(data)
+    if n_len > MAX_N_BYTES:
+        raise WireError(f"modulus of {n_len} bytes is larger than {MAX_N_BYTES}")
+    offset = N_LEN.size + n_len
+    if len(data) < offset:
+        raise WireError("truncated query")
+    n = backend.current.mpz(int.from_bytes(memoryview(data)[N_LEN.size:offset], "little"))
+    if n <= 1:
+        raise WireError("invalid modulus")
+    return decode_vector(memoryview(data)[offset:], n)
+
+
+def encode_stream(ct, chunk_ciphertexts=256):
+    """Yield the encoding of a vector in pieces of at most chunk_ciphertexts ciphertexts.
+
+    Each piece is a memoryview of the vector's buffer, so a large reply can be written to
+    a socket as it is produced without building one big bytes object.
+    """
+    parts = encode_vector(ct)
+    yield parts[0]
+    body = parts[1]
+    step = chunk_ciphertexts * _as_vector(ct).ctx.width
+    for start in range(0, len(body), step):
+        yield body[start:start + step]
+
+
+class StreamDecoder:
+    """Incremental decoder of a vector under modulus n.
+
+    feed() accepts the encoding in arbitrary pieces and returns the ciphertexts completed
+    by each piece, so a client can start decrypting a large reply before all of it has
+    arrived. The received bytes are assembled in one preallocated buffer, which vector()
+    returns as a CiphertextVector once everything has been fed.
+    """
+
+    def __init__(self, n):
+        self.n = n
+        self.ctx = None
+        self.count = None
+        self._header = bytearray()
+        self._buffer = None
+        self._filled = 0
+
+    @property
+    def done(self):
+        return self._buffer is not None and self._filled == len(self._buffer)
+
+    def feed(self, data):
+        data = memoryview(data)
+        if self._buffer is None:
+            need = HEADER.size - len(self._header)
+            self._header += data[:need]
+            data = data[need:]
+            if len(self._header) < HEADER.size:
+                return []
+            s, self.count = parse_header(self._header, self.n)
+            self.ctx = DamgardContext(self.n, s)
+            self._buffer = bytearray(self.count * self.ctx.width)
+        if len(data) > len(self._buffer) - self._filled:
+            raise WireError("more data than the header announced")
+        width = self.ctx.width
+        first = self._filled // width
+        self._buffer[self._filled:self._filled + len(data)] = data
+        self._filled += len(data)
+        view = memoryview(self._buffer)
+        return [int.from_bytes(view[i * width:(i + 1) * width], "little")
+                for i in range(first, self._filled // width)]
+
+    def vector(self):
+        if not self.done:
+            raise WireError("vector is incomplete")
+        return CiphertextVector(self.ctx, buffer=self._buffer)
+
+
+if __name__ == "__main__":
+    # Round-trips a few query and reply sizes and compares their bytes on the wire with
+    # bpail() from pir-compare.py, whose difference should be the constant headers alone
+    import importlib.util
+    import os
+    import sys
+
+    from database import Packing
+
+    spec = importlib.util.spec_from_file_location(
+        "pir_compare", os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "pir-compare.py"))
+    pir_compare = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(pir_compare)
+
+    bits = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    pk, sk = Damgard.keygen(bits // 2)
+    log2m = int(pk.n).bit_length()
+    print(f"{'rows':>6} {'payload':>8} {'measured (B)':>13} {'bpail (B)':>10} {'overhead (B)':>13}")
+    for rows, payload in [(16, 32), (64, 256), (256, 1024), (1024, 10240)]:
+        # The query and reply a PIRServer would take and give for this database
+        packing = Packing.for_rows(pk.n, 1, payload)
+        num_records = packing.num_records(rows, payload)
+        query = pk.encrypt([int(i == 3 // packing.rows_per_plaintext(payload)) for i in range(num_records)], 1)
+        reply = pk.encrypt(list(range(packing.num_plaintexts(payload))), 1)
+        measured = sum(map(len, encode_query(query))) + sum(map(len, encode_vector(reply)))
+        predicted = int(pir_compare.bpail(rows, payload, log2m) * 1024)
+        print(f"{rows:>6} {payload:>8} {measured:>13} {predicted:>10} {measured - predicted:>13}")
+
+        assert list(decode_query(b"".join(encode_query(query)))) == query.values
+        decoder = StreamDecoder(pk.n)
+        values = []
+        for piece in encode_stream(reply, chunk_ciphertexts=1):
+            for i in range(0, len(piece), 100):
+                values += decoder.feed(piece[i:i + 100])
+        assert decoder.done and values == reply.values == list(decoder.vector())
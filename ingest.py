@@ -0,0 +1,190 @@
+import argparse
+import json
+import os
+import re
+import sqlite3
+
+from protocols import BASE_UNITS, UNITS, load_protocols
+
+# Fields the resource probe adds to every run (see probe.py), in the same form as the
+# protocol metrics in protocols.toml.
+PROBE_METRICS = {
+    "Wall time (s)": ("s", "wall_time"),
+    "User CPU time (s)": ("s", "user_cpu_time"),
+    "System CPU time (s)": ("s", "system_cpu_time"),
+    "Max RSS (KB)": ("KB", "max_rss"),
+    "Voluntary context switches": ("count", "voluntary_ctx_switches"),
+    "Involuntary context switches": ("count", "involuntary_ctx_switches"),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    protocol TEXT NOT NULL,
+    num_rows INTEGER NOT NULL,
+    payload_byte_size INTEGER NOT NULL
+);
+-- One row per (run, metric). Schema metrics (snake_case, raw = 0) are normalized to us,
+-- B or count and summed over the fields that map to them; raw = 1 rows keep every numeric
+-- field of the run's JSON under its original name and unit.
+CREATE TABLE IF NOT EXISTS metrics (
+    run_id TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value REAL NOT NULL,
+    unit TEXT,
+    raw INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_protocol ON runs (protocol, num_rows, payload_byte_size);
+CREATE INDEX IF NOT EXISTS metrics_metric ON metrics (metric, run_id);
+CREATE INDEX IF NOT EXISTS metrics_run ON metrics (run_id);
+"""
+
+LOG_DIR_PATTERN = re.compile(r"logs-(\d+)-(\d+)$")
+
+# Bumped whenever normalize() changes, so that connect() makes ingest() re-read every file.
+# 2: SealPIR's max_element_size no longer adds to item_size, which doubled its payload.
+NORMALIZE_VERSION = 2
+
+
+def connect(db_path="logs/results.sqlite"):
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    db = sqlite3.connect(db_path)
+    db.executescript(SCHEMA)
+    (version,) = db.execute("PRAGMA user_version").fetchone()
+    if version < NORMALIZE_VERSION:
+        with db:
+            db.execute("DELETE FROM files")
+            db.execute(f"PRAGMA user_version = {NORMALIZE_VERSION}")
+    return db
+
+
+def result_files(log_root):
+    """Yield (path, protocol, sweep num_rows, sweep payload) for every parsed result JSON."""
+    for entry in sorted(os.listdir(log_root)):
+        match = LOG_DIR_PATTERN.match(entry)
+        if not match:
+            continue
+        num_rows, payload_byte_size = int(match.group(1)), int(match.group(2))
+        log_dir = os.path.join(log_root, entry)
+        for protocol in sorted(os.listdir(log_dir)):
+            protocol_dir = os.path.join(log_dir, protocol)
+            if not os.path.isdir(protocol_dir):
+                continue
+            for name in sorted(os.listdir(protocol_dir)):
+                if name.endswith(".json") and not name.endswith(".usage.json"):
+                    yield os.path.join(protocol_dir, name), protocol, num_rows, payload_byte_size
+
+
+def normalize(protocol, results):
+    """Map a run's JSON onto (metric, value, unit, raw) rows."""
+    rows = []
+    schema = {}
+    for field, value in results.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        if field in PROBE_METRICS:
+            unit, metric = PROBE_METRICS[field]
+        elif field == "Item size (B)":
+            unit, metric = "B", "item_size"
+        elif field == "Number of items":
+            unit, metric = "count", "num_items"
+        elif protocol is not None and field in protocol.metrics:
+            unit, metric = protocol.unit(field), protocol.schema_metric(field)
+        else:
+            unit, metric = None, None
+        rows.append((field, value, unit, 1))
+        if metric is not None:
+            total, _ = schema.get(metric, (0, None))
+            schema[metric] = (total + value * UNITS[unit], BASE_UNITS[unit])
+    rows.extend((metric, value, unit, 0) for metric, (value, unit) in schema.items())
+    return rows
+
+
+def ingest(log_root="logs", db_path="logs/results.sqlite", registry=None):
+    """Add new or changed result files under log_root to the database; return how many were read."""
+    registry = load_protocols() if registry is None else registry
+    db = connect(db_path)
+    seen = {path: (mtime, size) for path, mtime, size in db.execute("SELECT path, mtime, size FROM files")}
+    count = 0
+    with db:
+        for path, protocol, num_rows, payload_byte_size in result_files(log_root):
+            stat = os.stat(path)
+            if seen.get(path) == (stat.st_mtime, stat.st_size):
+                continue
+            try:
+                with open(path) as f:
+                    results = json.load(f)
+            except (OSError, ValueError):
+                # Probably being written right now; pick it up on the next pass
+                continue
+            run_id = os.path.splitext(os.path.basename(path))[0]
+            db.execute("DELETE FROM metrics WHERE run_id = ?", (run_id,))
+            db.execute("INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?)",
+                       (run_id, path, protocol, num_rows, payload_byte_size))
+            db.executemany("INSERT INTO metrics VALUES (?, ?, ?, ?, ?)",
+                           [(run_id, *row) for row in normalize(registry.get(protocol), results)])
+            db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?)", (path, stat.st_mtime, stat.st_size))
+            count += 1
+    db.close()
+    return count
+
+
+def query(db_path="logs/results.sqlite", metrics=None, raw=False, **filters):
+    """Return one dict per run with the metrics matching the filters.
+
+    filters are equality (or, for lists, IN) conditions on the runs columns protocol,
+    num_rows and payload_byte_size; min_num_rows/max_num_rows bound the size. All of them
+    and the metrics list are evaluated by SQLite, so only matching rows are read. Each run
+    comes back as a dict of its metrics plus run_id, protocol, num_rows and
+    payload_byte_size.
+    """
+    conditions, args = ["m.raw = ?"], [int(raw)]
+    for column in ("protocol", "num_rows", "payload_byte_size"):
+        value = filters.pop(column, None)
+        if value is None:
+            continue
+        values = value if isinstance(value, (list, tuple, set)) else [value]
+        conditions.append(f"r.{column} IN ({', '.join('?' * len(values))})")
+        args.extend(values)
+    if "min_num_rows" in filters:
+        conditions.append("r.num_rows >= ?")
+        args.append(filters.pop("min_num_rows"))
+    if "max_num_rows" in filters:
+        conditions.append("r.num_rows <= ?")
+        args.append(filters.pop("max_num_rows"))
+    assert not filters, f"unknown filters {sorted(filters)}"
+    if metrics is not None:
+        conditions.append(f"m.metric IN ({', '.join('?' * len(metrics))})")
+        args.extend(metrics)
+
+    sql = ("SELECT r.run_id, r.protocol, r.num_rows, r.payload_byte_size, m.metric, m.value "
+           "FROM metrics m JOIN runs r ON r.run_id = m.run_id WHERE " + " AND ".join(conditions) +
+           " ORDER BY r.protocol, r.num_rows, r.run_id")
+    db = connect(db_path)
+    runs = {}
+    for run_id, protocol, num_rows, payload_byte_size, metric, value in db.execute(sql, args):
+        run = runs.setdefault(run_id, {"run_id": run_id, "protocol": protocol, "num_rows": num_rows,
+                                       "payload_byte_size": payload_byte_size})
+        run[metric] = value
+    db.close()
+    return list(runs.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest parsed benchmark results into one SQLite file")
+    parser.add_argument("--logs", default="logs", help="root of the logs-{num_rows}-{payload} directories")
+    parser.add_argument("--db", default="logs/results.sqlite")
+    parser.add_argument("--protocols", default="protocols.toml")
+    args = parser.parse_args()
+    count = ingest(args.logs, args.db, load_protocols(args.protocols))
+    print(f"Ingested {count} new or updated result files into {args.db}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,81 +1,82 @@
+import itertools
 import sys
 import numpy as np
 from matplotlib import pyplot as plt
-import math
 
-def bpail(x,pay): # BasicPIR w Paillier in KB
-    log2m = 2048
-    req_size = (x * 2 * log2m) / 8192
-    resp_size = (2 * log2m * math.ceil(float(pay) * float(8/log2m))) / 8192
+# Communication models of the PIR protocols, in KB. Every argument may be a NumPy array
+# (or a scalar) and they all broadcast against each other, so a whole grid of
+# (rows x, payload, N_poly, log q, d, ...) points is evaluated in one call. The default
+# arguments are the parameter sets the implementations ship with; search() looks for
+# cheaper ones.
+
+# Largest ciphertext modulus (bits) for 128-bit classical security per polynomial degree,
+# from the homomorphic encryption standard. SEAL's default BFV moduli use exactly these.
+HE_MAX_LOG2Q = {1024: 27, 2048: 54, 4096: 109, 8192: 218, 16384: 438, 32768: 881}
+
+# A plaintext modulo a log2m-bit n carries (log2m - 1) // 8 whole bytes of a row
+# (database.Packing), e.g. 255 of 256 for a 2048-bit n, which is how rows are packed
+def paillier_plaintexts(pay,log2m):
+    return np.ceil(np.asarray(pay) / ((log2m - 1) // 8))
+
+# When at least two rows fit in a plaintext, each takes a slot of its own
+# (database.Packing.for_rows), so a query selects one record of that many rows
+def paillier_rows_per_record(pay,log2m):
+    slots = (log2m - 1) // (8 * np.maximum(np.asarray(pay), 1))
+    return np.where(slots >= 2, slots, 1)
+
+def bpail(x,pay,log2m=2048): # BasicPIR w Paillier in KB
+    records = np.ceil(np.asarray(x) / paillier_rows_per_record(pay, log2m))
+    req_size = (records * 2 * log2m) / 8192
+    resp_size = (2 * log2m * paillier_plaintexts(pay, log2m)) / 8192
+    return req_size + resp_size
+
+def dpail(x,pay,d=2,log2m=2048): # d-dimensional PIR w Damgard-Jurik (s = 1 layering) in KB
+    # The hypercube is over records of packed rows, as in bpail
+    side = np.ceil(np.power(np.ceil(np.asarray(x) / paillier_rows_per_record(pay, log2m)), 1.0/d))
+    # Level j of the query holds side ciphertexts of (j + 2) * log2m bits, j = 0 .. d-1
+    req_size = side * log2m * d * (d + 3) / 2 / 8192
+    resp_size = ((d + 1) * log2m * paillier_plaintexts(pay, log2m)) / 8192
     return req_size + resp_size
 
-def blwe(x,pay): # BasicPIR w LWE in KB
-    n = 750
-    log2q = 64
-    lmbda = 128
-    log2p = 16
+def blwe(x,pay,n=750,log2q=64,lmbda=128,log2p=16): # BasicPIR w LWE in KB
     req_size = (x * (lmbda + log2q)) / 8192
-    resp_size = (n * log2q * math.ceil(float(pay) * float(8/log2p))) / 8192
+    resp_size = (n * log2q * np.ceil(np.asarray(pay) * 8 / log2p)) / 8192
     return req_size + resp_size
 
-def sealpir(x,pay): #SealPIR (d = 2) in KB
-    N = 4096
-    log2q = 109
-    log2p = 20
-    lmbda = 128
-    crypto_setup = (math.log2(N) * (lmbda + N * log2q)) / 8192
-    req_size = (np.ceil(2 * np.sqrt(x)/N)*(lmbda + N * log2q)) / 8192
-    resp_size = (2 * N * log2q * np.ceil(log2q/log2p) * np.ceil(pay/(N*log2p))) / 8192
+def sealpir(x,pay,N=4096,log2q=109,log2p=20,lmbda=128,d=2): #SealPIR (d = 2) in KB
+    crypto_setup = (np.log2(N) * (lmbda + N * log2q)) / 8192
+    req_size = (np.ceil(d * np.power(x, 1.0/d)/N)*(lmbda + N * log2q)) / 8192
+    # Each dimension after the first expands the reply by ceil(log q / log p) ciphertexts
+    resp_size = (2 * N * log2q * np.power(np.ceil(log2q/log2p), d - 1) * np.ceil(pay/(N*log2p))) / 8192
     return crypto_setup + req_size + resp_size
 
-def fastpir(x,pay): #FastPIR (d = 1) in KB
-    N = 4096
-    log2q = 109
-    log2p = 20
-    lmbda = 128
-    crypto_setup = (math.log2(N) * (lmbda + N * log2q)) / 8192
+def fastpir(x,pay,N=4096,log2q=109,log2p=20,lmbda=128): #FastPIR (d = 1) in KB
+    crypto_setup = (np.log2(N) * (lmbda + N * log2q)) / 8192
     req_size = (np.ceil(2 * x / N)*(lmbda + N * log2q)) / 8192
     resp_size = (2 * N * log2q * np.ceil(pay/(N*log2p))) / 8192
     return crypto_setup + req_size + resp_size
 
-def mulpir(x,pay): #MulPIR in KB
-    N = 8192
-    log2q = 218
-    log2p = 20
-    lmbda = 128
-    crypto_setup = (np.ceil(math.log2(N)) + 1)*(lmbda + N * log2q) / 8192 
-    req_size = (np.ceil(2 * np.sqrt(x) / N)*(lmbda + N * log2q)) / 8192
+def mulpir(x,pay,N=8192,log2q=218,log2p=20,lmbda=128,d=2): #MulPIR in KB
+    crypto_setup = (np.ceil(np.log2(N)) + 1)*(lmbda + N * log2q) / 8192
+    req_size = (np.ceil(d * np.power(x, 1.0/d) / N)*(lmbda + N * log2q)) / 8192
     resp_size = (2 * N * log2q * np.ceil(pay/(N*log2p))) / 8192
     return crypto_setup + req_size + resp_size
 
-def cwpir(x,pay): #Constant-weight PIR (h = 2) in KB
-    N = 8192
-    log2q = 218
-    log2p = 20
-    lmbda = 128
-    crypto_setup = (np.ceil(math.log2(N)) + 1)*(lmbda + N * log2q) / 8192 
+def cwpir(x,pay,N=8192,log2q=218,log2p=20,lmbda=128): #Constant-weight PIR (h = 2) in KB
+    crypto_setup = (np.ceil(np.log2(N)) + 1)*(lmbda + N * log2q) / 8192
     req_size = (np.ceil(np.sqrt(x) / N)*(lmbda + N * log2q)) / 8192
     resp_size = (2 * N * log2q * np.ceil(pay/(N*log2p))) / 8192
     return crypto_setup + req_size + resp_size
 
-def onionpir(x,pay): #OnionPIR (d = 2) in KB
-    N = 4096
-    log2q = 128
-    log2p = 60
-    lmbda = 128
-    logB = 31
+def onionpir(x,pay,N=4096,log2q=128,log2p=60,lmbda=128,logB=31): #OnionPIR (d = 2) in KB
     ell = np.ceil(log2q / logB)
-    crypto_setup = ((math.log2(N) * (lmbda + N * log2q)) + (ell * (lmbda + N * log2q))) / 8192 # to fix ?
+    crypto_setup = ((np.log2(N) * (lmbda + N * log2q)) + (ell * (lmbda + N * log2q))) / 8192 # to fix ?
     req_size = (np.ceil(2 * np.sqrt(x)/N) * (lmbda + N * log2q)) / 8192
     resp_size = (2 * N * log2q * np.ceil(pay/(N*log2p))) / 8192
     return crypto_setup + req_size + resp_size
 
-def frodopir(x,pay): #FrodoPIR in KB
-    n = 1774
-    log2q = 32
-    log2ro = 10
-    lmbda = 128
-    w = pay * 8
+def frodopir(x,pay,n=1774,log2q=32,log2ro=10,lmbda=128): #FrodoPIR in KB
+    w = np.asarray(pay) * 8
     omega = np.ceil(w/log2ro)
     setup = (lmbda + n * omega * log2q) / 8192
     req_size = (x * log2q) / 8192
@@ -83,11 +84,116 @@ def frodopir(x,pay): #FrodoPIR in KB
     return setup + req_size + resp_size
 
 
+def seal_modulus(N, log2p, d):
+    """SEAL's default ciphertext modulus for degree N, or None if it is too small for d dimensions.
+
+    Rough BFV noise model: the plaintext takes log2p bits and each dimension (one
+    plaintext-ciphertext product after query expansion) adds about log2(N) + log2p bits.
+    """
+    log2q = HE_MAX_LOG2Q[N]
+    return log2q if log2p + d * (np.log2(N) + log2p) <= log2q else None
+
+def fhe_params(N, log2p, d=1):
+    log2q = seal_modulus(N, log2p, d)
+    return None if log2q is None else {"log2q": log2q}
+
+def cwpir_params(N, log2p):
+    # The constant-weight (h = 2) selection costs one ciphertext product on top of the
+    # plaintext product, so it needs the noise budget of two dimensions
+    return fhe_params(N, log2p, d=2)
+
+def onionpir_params(N, log2p, logB):
+    """OnionPIR's modulus for degree N, or None if its noise does not fit.
+
+    The first dimension is a BFV plaintext product as in seal_modulus; the second is an
+    RGSW external product, which adds about log2(ell * N) + logB bits without
+    involving the plaintext.
+    """
+    log2q = HE_MAX_LOG2Q[N]
+    ell = np.ceil(log2q / logB)
+    noise = log2p + np.log2(N) + log2p + np.log2(ell * N) + logB
+    return {"log2q": log2q} if noise <= log2q else None
+
+# LWE dimension for about 128-bit security per modulus size, as in SimplePIR
+LWE_DIMENSION = {32: 1024, 64: 2048}
+LWE_TAIL = 7.45 # standard deviations beyond which a Gaussian has mass below 2^-40
+
+def lwe_correct(x, log2q, log2p, sigma):
+    """Whether an LWE answer over x rows of entries below 2^log2p decrypts correctly.
+
+    The error of the x-term inner product has standard deviation sigma * p * sqrt(x / 3)
+    for uniform entries, and must stay below q / (2p). Unlike the FHE bounds this depends
+    on the database size, so it is applied per grid point.
+    """
+    spread = np.log2(2 * LWE_TAIL * sigma * np.sqrt(np.maximum(np.asarray(x, dtype=float), 1) / 3))
+    return 2 * log2p + spread <= log2q
+
+POLY_DEGREES = [2048, 4096, 8192, 16384, 32768]
+PLAIN_BITS = [12, 16, 20, 24, 30, 40, 60]
+LWE_PLAIN_BITS = [2, 4, 6, 8, 9, 10, 11, 12, 14, 16, 20, 24]
+GADGET_BITS = [16, 20, 24, 31, 40]
+DIMENSIONS = [1, 2, 3, 4]
+
+# Parameter space searched per protocol: (model, candidates per argument, function that
+# derives the remaining arguments from a candidate or returns None if it is infeasible,
+# function of (x, pay, **params) that masks the grid points where it is infeasible).
+# bpail has no entry: its only parameter is the key size, which security fixes.
+SPACES = {
+    "dpail": (dpail, {"d": DIMENSIONS}, None, None),
+    "blwe": (blwe, {"log2q": list(LWE_DIMENSION), "log2p": LWE_PLAIN_BITS},
+             lambda log2q, log2p: {"n": LWE_DIMENSION[log2q]},
+             lambda x, pay, n, log2q, log2p: lwe_correct(x, log2q, log2p, sigma=6.4)),
+    "sealpir": (sealpir, {"N": POLY_DEGREES, "log2p": PLAIN_BITS, "d": DIMENSIONS}, fhe_params, None),
+    "fastpir": (fastpir, {"N": POLY_DEGREES, "log2p": PLAIN_BITS}, fhe_params, None),
+    "mulpir": (mulpir, {"N": POLY_DEGREES, "log2p": PLAIN_BITS, "d": DIMENSIONS}, fhe_params, None),
+    "cwpir": (cwpir, {"N": POLY_DEGREES, "log2p": PLAIN_BITS}, cwpir_params, None),
+    "onionpir": (onionpir, {"N": POLY_DEGREES, "log2p": PLAIN_BITS, "logB": GADGET_BITS}, onionpir_params, None),
+    # FrodoPIR fixes n = 1774 and q = 2^32 for security and picks rho per database size
+    "frodopir": (frodopir, {"log2ro": LWE_PLAIN_BITS}, None,
+                 lambda x, pay, log2ro: lwe_correct(x, 32, log2ro, sigma=3.2)),
+}
+
+def candidates(protocol):
+    """Every feasible parameter set of protocol, as keyword-argument dicts."""
+    model, space, derive, _ = SPACES[protocol]
+    names = list(space)
+    for values in itertools.product(*(space[name] for name in names)):
+        params = dict(zip(names, values))
+        derived = {} if derive is None else derive(**params)
+        if derived is not None:
+            yield {**params, **derived}
+
+def search(protocol, x, pay):
+    """Cheapest total communication (KB) of protocol at every (x, pay) grid point.
+
+    x and pay broadcast against each other. Each feasible parameter set is evaluated over
+    the whole grid at once and only the running minimum is kept, so memory stays at a
+    few grid-sized arrays however large the space is. Returns (cost, params), where
+    params maps every searched or derived argument to an array of its optimal value;
+    cost is inf where no parameter set is feasible.
+    """
+    model, _, _, feasible = SPACES[protocol]
+    x, pay = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(pay, dtype=float))
+    best = np.full(x.shape, np.inf)
+    best_index = np.zeros(x.shape, dtype=np.int32)
+    better = np.empty(x.shape, dtype=bool)
+    sets = list(candidates(protocol))
+    for i, params in enumerate(sets):
+        cost = model(x, pay, **params)
+        if feasible is not None:
+            cost = np.where(feasible(x, pay, **params), cost, np.inf)
+        np.less(cost, best, out=better)
+        np.copyto(best, cost, where=better)
+        np.copyto(best_index, i, where=better)
+    params = {name: np.array([p[name] for p in sets])[best_index] for name in sets[0]}
+    return best, params
+
+
 if __name__ == "__main__":
     payload_size = int(sys.argv[1])
     #num_rows = sys.argv[2]
-    num_rows = np.linspace(0,100000, 10)
-   
+    num_rows = np.linspace(0,100000, 1000)
+
     # print(" --- computing communication cost for PIR protocols ----")
     # print(bpail(4096,payload_size)/1024)
     # print(blwe(4096,payload_size)/1024)
@@ -99,6 +205,7 @@ if __name__ == "__main__":
     # print(frodopir(4096,payload_size)/1024)
 
     plt.plot(num_rows, bpail(num_rows, payload_size)/1024, color='red', label='BasicPIR w Paillier')
+    plt.plot(num_rows, dpail(num_rows, payload_size)/1024, color='brown', label='2-dim PIR w Damgard-Jurik')
     plt.plot(num_rows, blwe(num_rows, payload_size)/1024, color='orange', label='BasicPIR w LWE')
     plt.plot(num_rows, sealpir(num_rows, payload_size)/1024, color='yellow', label='SealPIR')
     plt.plot(num_rows, fastpir(num_rows, payload_size)/1024, color='green', label='FastPIR')
@@ -106,7 +213,12 @@ if __name__ == "__main__":
     plt.plot(num_rows, cwpir(num_rows, payload_size)/1024, color='indigo', label='Constant weight PIR')
     plt.plot(num_rows, onionpir(num_rows, payload_size)/1024, color='violet', label='OnionPIR')
     plt.plot(num_rows, frodopir(num_rows, payload_size)/1024, color='black', label='FrodoPIR')
+    # Dashed: the same protocol with the cheapest parameters at every size
+    for protocol, color in [("dpail", 'brown'), ("blwe", 'orange'), ("sealpir", 'yellow'), ("fastpir", 'green'),
+                            ("mulpir", 'blue'), ("cwpir", 'indigo'), ("onionpir", 'violet'), ("frodopir", 'black')]:
+        cost, _ = search(protocol, num_rows, payload_size)
+        plt.plot(num_rows, cost/1024, color=color, linestyle='--')
     plt.legend()
     plt.xlabel("Number of Rows")
     plt.ylabel("Communication Cost (MB)")
-    plt.show()
\ No newline at end of file
+    plt.show()
@@ -0,0 +1,124 @@
+import json
+import os
+import signal
+import subprocess
+import threading
+import time
+
+
+def _children(pid):
+    """Direct children of pid, from /proc/<pid>/task/*/children."""
+    children = []
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                children.extend(int(c) for c in f.read().split())
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        pass
+    return children
+
+
+def _rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        pass
+    return 0
+
+
+def tree_rss_kb(pid):
+    """Resident memory of pid and all of its descendants, in KB."""
+    total = 0
+    stack = [pid]
+    while stack:
+        p = stack.pop()
+        total += _rss_kb(p)
+        stack.extend(_children(p))
+    return total
+
+
+class Probe:
+    """Samples the memory of a running process tree and collects its rusage when it exits.
+
+    Wall time comes from time.perf_counter, CPU time, max RSS and context switches from
+    os.wait4 (which accounts for waited-for descendants as well), and the memory-over-time
+    curve from periodic /proc/<pid>/status reads over the whole process tree. The curve
+    keeps at most max_samples points by halving its resolution whenever it fills up.
+
+    With a timeout (seconds of wall time) or max_rss_kb (resident memory of the whole
+    tree), the process group is killed as soon as either limit is crossed, and the usage
+    records which one under "Exceeded".
+    """
+
+    def __init__(self, interval=0.1, max_samples=1000, timeout=None, max_rss_kb=None):
+        self.interval = interval
+        self.max_samples = max_samples
+        self.timeout = timeout
+        self.max_rss_kb = max_rss_kb
+
+    def run(self, command, **popen_kwargs):
+        """Run command to completion; return (exit code, usage dict)."""
+        limited = self.timeout is not None or self.max_rss_kb is not None
+        start = time.perf_counter()
+        # With limits, run the command in its own session so the whole tree can be killed
+        proc = subprocess.Popen(command, start_new_session=limited, **popen_kwargs)
+        samples = []
+        exceeded = []
+        done = threading.Event()
+        sampler = threading.Thread(target=self._sample, args=(proc.pid, start, samples, exceeded, done),
+                                   daemon=True)
+        sampler.start()
+        _, status, rusage = os.wait4(proc.pid, 0)
+        wall = time.perf_counter() - start
+        done.set()
+        sampler.join()
+        # wait4 reaped the child, so tell Popen not to wait for it again
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        usage = {
+            "Wall time (s)": round(wall, 6),
+            "User CPU time (s)": round(rusage.ru_utime, 6),
+            "System CPU time (s)": round(rusage.ru_stime, 6),
+            "Max RSS (KB)": rusage.ru_maxrss,
+            "Voluntary context switches": rusage.ru_nvcsw,
+            "Involuntary context switches": rusage.ru_nivcsw,
+            "RSS over time (s, KB)": samples,
+        }
+        if exceeded:
+            usage["Exceeded"] = exceeded[0]
+        return proc.returncode, usage
+
+    def _sample(self, pid, start, samples, exceeded, done):
+        record_interval = self.interval
+        last_record = None
+        while not done.is_set():
+            elapsed = time.perf_counter() - start
+            rss = tree_rss_kb(pid)
+            if rss and (last_record is None or elapsed - last_record >= record_interval):
+                samples.append([round(elapsed, 3), rss])
+                last_record = elapsed
+                if len(samples) >= self.max_samples:
+                    samples[:] = samples[::2]
+                    record_interval *= 2
+            if not exceeded:
+                if self.timeout is not None and elapsed > self.timeout:
+                    exceeded.append("timeout")
+                elif self.max_rss_kb is not None and rss > self.max_rss_kb:
+                    exceeded.append("memory")
+                if exceeded:
+                    try:
+                        os.killpg(pid, signal.SIGKILL)
+                    except (ProcessLookupError, PermissionError):
+                        pass
+            done.wait(self.interval)
+
+
+def merge_usage(json_path, usage):
+    """Add the probe measurements to a protocol's parsed JSON results."""
+    with open(json_path) as f:
+        results = json.load(f)
+    results.update(usage)
+    with open(json_path, "w") as f:
+        json.dump(results, f, indent=4)
@@ -0,0 +1,132 @@
+import json
+import re
+import tomllib
+
+# Units a metric can be declared in, and their factor to the base unit (us or B) that
+# ingestion normalizes to.
+UNITS = {"us": 1, "ms": 1000, "s": 1000000, "B": 1, "KB": 1024, "MB": 1024 * 1024, "count": 1}
+BASE_UNITS = {"us": "us", "ms": "us", "s": "us", "B": "B", "KB": "B", "MB": "B", "count": "count"}
+
+
+class Protocol:
+    """One benchmarked PIR implementation, as declared in protocols.toml.
+
+    command and env values are templates formatted with num_rows, log_num_rows, payload
+    (the payload in bytes after resolving 0 to default_payload) and threads (the number
+    of cores the job was given). Each metric maps an output field name to its unit, the
+    common-schema metric it contributes to (if any) and, for "regex" output, the pattern
+    whose first group holds the integer value. Protocols with "json" output print their
+    results as a JSON object, and their metrics only declare units and schema names.
+    """
+
+    def __init__(self, name, command, binary, default_payload, metrics, output="regex", cwd=".",
+                 env=None, log_num_rows=(0, 64), threads=1, setup=None, timeout_s=None, max_rss_mb=None):
+        self.name = name
+        self.command = list(command)
+        self.binary = binary
+        self.default_payload = default_payload
+        self.output = output
+        self.cwd = cwd
+        self.env = dict(env or {})
+        self.min_log_num_rows, self.max_log_num_rows = log_num_rows
+        self.threads = threads
+        self.setup = list(setup) if setup else None
+        # Per-job budgets; None falls back to the sweep's defaults
+        self.timeout_s = timeout_s
+        self.max_rss_mb = max_rss_mb
+        self.metrics = {}
+        for field, spec in metrics.items():
+            unit = spec.get("unit", "count")
+            assert unit in UNITS, f"{name}: unknown unit {unit!r} for {field!r}"
+            assert output == "json" or "pattern" in spec, f"{name}: metric {field!r} has no pattern"
+            pattern = re.compile(spec["pattern"], re.DOTALL) if "pattern" in spec else None
+            self.metrics[field] = (pattern, unit, spec.get("metric"))
+        assert output in ("regex", "json"), f"{name}: output must be 'regex' or 'json'"
+
+    def supports(self, log_num_rows):
+        return self.min_log_num_rows <= log_num_rows <= self.max_log_num_rows
+
+    def payload(self, payload_byte_size):
+        # Payload size of 0 means that each protocol will the largest payload size it supports
+        return self.default_payload if payload_byte_size == 0 else payload_byte_size
+
+    def limits(self, sweep):
+        """(timeout in seconds, max RSS in KB) for one job; None means unlimited."""
+        timeout = self.timeout_s if self.timeout_s is not None else sweep["timeout_s"]
+        max_rss_mb = self.max_rss_mb if self.max_rss_mb is not None else sweep["max_rss_mb"]
+        return timeout, None if max_rss_mb is None else max_rss_mb * 1024
+
+    def unit(self, field):
+        spec = self.metrics.get(field)
+        return None if spec is None else spec[1]
+
+    def schema_metric(self, field):
+        spec = self.metrics.get(field)
+        return None if spec is None else spec[2]
+
+    def render(self, num_rows, log_num_rows, payload, threads):
+        values = {"num_rows": num_rows, "log_num_rows": log_num_rows, "payload": payload, "threads": threads}
+        command = [part.format(**values) for part in self.command]
+        env = {key: str(value).format(**values) for key, value in self.env.items()} or None
+        return command, env
+
+    def parse(self, log_file, json_file, num_rows, payload):
+        """Extract the metrics from a run's output and write them to json_file."""
+        with open(log_file, 'r') as f:
+            log_content = f.read()
+
+        results = {
+            "Number of items": num_rows,
+            "Item size (B)": payload,
+        }
+        if self.output == "json":
+            results.update(json.loads(log_content))
+        else:
+            for field, (pattern, _, _) in self.metrics.items():
+                match = pattern.search(log_content)
+                results[field] = int(match.group(1)) if match else None
+
+        with open(json_file, 'w') as f:
+            json.dump(results, f, indent=4)
+        return results
+
+
+def load_protocols(path="protocols.toml"):
+    """Build the protocol registry from a TOML file with one table per protocol."""
+    with open(path, "rb") as f:
+        config = tomllib.load(f)
+    registry = {}
+    for name, spec in config.items():
+        spec = dict(spec)
+        if "log_num_rows" in spec:
+            spec["log_num_rows"] = tuple(spec["log_num_rows"])
+        registry[name] = Protocol(name, **spec)
+    return registry
+
+
+ADAPTIVE_DEFAULTS = {
+    "metric": "server_time",
+    "min_runs": 3,
+    "max_runs": 30,
+    "target_rel_error": 0.05,
+    "confidence": 0.95,
+    "budget_s": None,
+}
+
+
+def load_sweep(path="sweep.toml", adaptive=False):
+    """Read the sweep matrix; adaptive forces adaptive repetition even without an [adaptive] table."""
+    with open(path, "rb") as f:
+        sweep = tomllib.load(f)
+    sweep.setdefault("runs", 3)
+    sweep.setdefault("payload_byte_sizes", [0])
+    sweep.setdefault("mode", "exclusive")
+    sweep.setdefault("timeout_s", None)
+    sweep.setdefault("max_rss_mb", None)
+    settings = sweep.get("adaptive", {"enabled": False})
+    if adaptive or settings.get("enabled", True):
+        sweep["adaptive"] = {key: settings.get(key, default) for key, default in ADAPTIVE_DEFAULTS.items()}
+    else:
+        sweep["adaptive"] = None
+    assert "log_num_rows" in sweep and "protocols" in sweep, f"{path} needs log_num_rows and protocols"
+    return sweep
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import subprocess
+import threading
+import time
+
+
+def file_digest(path):
+    """Content hash of a binary, or of the git checkout HEAD if path is a directory."""
+    if os.path.isdir(path):
+        try:
+            head = subprocess.check_output(["git", "-C", path, "rev-parse", "HEAD"], stderr=subprocess.DEVNULL)
+            return "git-" + head.decode().strip()
+        except (subprocess.CalledProcessError, FileNotFoundError):
+            return "missing"
+    if not os.path.exists(path):
+        return "missing"
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class ResultStore:
+    """Append-only record of finished benchmark jobs, used to resume an interrupted sweep.
+
+    Every job is identified by a content-addressed key over its protocol, the hash of the
+    binary that runs it, its parameters, the command line, working directory and
+    environment it runs with, and its run index. The key doubles as the id of the job's
+    log files, so a rerun of the same configuration overwrites its own logs, and a rebuilt
+    binary or an edited protocols.toml entry gets fresh ones. Each line of the store is
+    one JSON record; the last record for a key wins.
+    """
+
+    def __init__(self, path="logs/results.jsonl"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._digests = {}
+        self._records = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn last line from a crash; the job simply runs again.
+                        continue
+                    self._records[record["key"]] = record
+
+    def binary_digest(self, path):
+        with self._lock:
+            if path not in self._digests:
+                self._digests[path] = file_digest(path)
+            return self._digests[path]
+
+    def key(self, protocol, binary, params, run, command=(), cwd=".", env=None):
+        identity = {
+            "protocol": protocol,
+            "binary": self.binary_digest(binary),
+            "params": params,
+            "command": list(command),
+            "cwd": cwd,
+            "env": env or {},
+            "run": run,
+        }
+        return hashlib.sha256(json.dumps(identity, sort_keys=True).encode()).hexdigest()[:20]
+
+    def status(self, key):
+        record = self._records.get(key)
+        return None if record is None else record["status"]
+
+    def completed(self, key, retry_exceeded=False):
+        """Whether the job needs no rerun: it succeeded, or it blew its budget (unless retrying those)."""
+        status = self.status(key)
+        return status == "success" or (status == "exceeded" and not retry_exceeded)
+
+    def records(self):
+        return list(self._records.values())
+
+    def record(self, key, status, **fields):
+        record = {"key": key, "status": status, "time": time.time(), **fields}
+        with self._lock:
+            self._records[key] = record
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+
+class SizeCeilings:
+    """Per (protocol, payload), the smallest number of rows at which a job exceeded its budget.
+
+    Jobs at that size or larger are not worth scheduling: if 2^k rows blew the time or
+    memory budget, 2^(k+1) rows will too. Ceilings are seeded from the "exceeded" records
+    of a result store so that a resumed sweep keeps them.
+    """
+
+    def __init__(self, store=None):
+        self._lock = threading.Lock()
+        self._ceilings = {}
+        for record in store.records() if store is not None else []:
+            if record["status"] == "exceeded":
+                self.exceeded(record["protocol"], record["payload_byte_size"], record["num_rows"])
+
+    def exceeded(self, protocol, payload_byte_size, num_rows):
+        key = (protocol, payload_byte_size)
+        with self._lock:
+            self._ceilings[key] = min(num_rows, self._ceilings.get(key, num_rows))
+
+    def allows(self, protocol, payload_byte_size, num_rows):
+        with self._lock:
+            ceiling = self._ceilings.get((protocol, payload_byte_size))
+        return ceiling is None or num_rows < ceiling
@@ -4,7 +4,16 @@ docker run -dit --name dhtpir-container rasoulam/dhtpir-ipfs
 # Wait for a few seconds to ensure the container is fully up and running
 sleep 5
 
-docker cp run.py dhtpir-container:/root/dhtpir-ipfs/
+for f in run.py scheduler.py results.py probe.py ingest.py stats.py timemodel.py protocols.py protocols.toml sweep.toml; do
+    docker cp $f dhtpir-container:/root/dhtpir-ipfs/
+done
+
+# Seed the container with the logs of an earlier, interrupted sweep; jobs recorded as
+# successful in logs/results.jsonl are skipped and failed ones are run again
+if [ -d logs ]; then
+    docker cp logs dhtpir-container:/root/dhtpir-ipfs/
+fi
+
 docker exec dhtpir-container bash -c "python3 /root/dhtpir-ipfs/run.py"
 
 # Copy the output file from the container to the host
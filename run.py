@@ -1,9 +1,16 @@
+import argparse
 import subprocess
-import re
 import json
-import math
 import os
-import time
+
+from functools import partial
+
+from ingest import ingest, normalize
+from probe import Probe, merge_usage
+from protocols import load_protocols, load_sweep
+from results import ResultStore, SizeCeilings
+from scheduler import Scheduler, available_cores, pin_to
+from stats import summarize
 
 def run_command_no_output(command):
     # return True
@@ -14,7 +21,12 @@ def run_command_no_output(command):
         print(f"Failed to run: {' '.join(command)}")
         return False
 
-def run_command(command, output_file, cwd=".", env=None):
+def run_command(command, output_file, cwd=".", env=None, cores=None, timeout=None, max_rss_kb=None):
+    """Run command with its stdout in output_file; return "success", "failed" or "exceeded".
+
+    The command is killed once it runs longer than timeout seconds or its process tree
+    uses more than max_rss_kb of resident memory, which counts as "exceeded".
+    """
     # Get the current environment, modify it with env, or use a new environment
     if env is not None:
         # Create a copy of the current environment and update it
@@ -23,322 +35,235 @@ def run_command(command, output_file, cwd=".", env=None):
     else:
         current_env = None  # This makes subprocess use the current environment
 
+    # stderr and the resource usage go next to the output, e.g. {id}.err and {id}.usage.json
+    base = os.path.splitext(output_file)[0]
     try:
-        with open(output_file, 'w') as f:
-            subprocess.check_call(command, cwd=cwd, stdout=f, stderr=open('err.txt', 'w'), env=current_env)
-        print(f"Success {command}")
-        return True
-    except subprocess.CalledProcessError:
+        with open(output_file, 'w') as f, open(f"{base}.err", 'w') as err:
+            probe = Probe(timeout=timeout, max_rss_kb=max_rss_kb)
+            returncode, usage = probe.run(pin_to(command, cores), cwd=cwd, stdout=f, stderr=err, env=current_env)
+    except OSError as e:
+        print(f"Failed to run: {' '.join(command)} ({e})")
+        return "failed"
+    with open(f"{base}.usage.json", 'w') as f:
+        json.dump(usage, f, indent=4)
+    if "Exceeded" in usage:
+        print(f"Exceeded {usage['Exceeded']} budget: {' '.join(command)}")
+        return "exceeded"
+    if returncode != 0:
         print(f"Failed to run: {' '.join(command)}")
-        return False
+        return "failed"
+    print(f"Success {command}")
+    return "success"
+
+class Job:
+    def __init__(self, protocol, num_rows, log_num_rows, payload_byte_size, run):
+        self.protocol = protocol
+        self.num_rows = num_rows
+        self.log_num_rows = log_num_rows
+        self.payload_byte_size = payload_byte_size
+        self.run = run
+        self.threads = protocol.threads
+        self.id = None
+
+    @property
+    def name(self):
+        return self.protocol.name
+
+    @property
+    def log_dir(self):
+        return f"logs/logs-{self.num_rows}-{self.payload_byte_size}"
+
+    @property
+    def params(self):
+        return {"num_rows": self.num_rows, "payload_byte_size": self.payload_byte_size}
+
+    def __repr__(self):
+        return f"Job({self.name}, num_rows={self.num_rows}, payload={self.payload_byte_size}, run={self.run})"
+
+
+def build_jobs(registry, sweep):
+    """The full sweep matrix, skipping sizes a protocol does not support."""
+    jobs = []
+    for run in range(sweep["runs"]):
+        for payload_byte_size in sweep["payload_byte_sizes"]:
+            for log_num_rows in sweep["log_num_rows"]:
+                for name in sweep["protocols"]:
+                    protocol = registry[name]
+                    if protocol.supports(log_num_rows):
+                        jobs.append(Job(protocol, 2**log_num_rows, log_num_rows, payload_byte_size, run))
+    return jobs
+
+
+def run_job(job, cores, store, ceilings, sweep, retry_exceeded=False):
+    protocol = job.protocol
+    payload = protocol.payload(job.payload_byte_size)
+    command, env = protocol.render(job.num_rows, job.log_num_rows, payload, len(cores))
+    # The key covers the job as it will actually run, so editing its protocols.toml entry
+    # (command, env, default_payload) does not reuse results of the old configuration
+    job.id = store.key(job.name, protocol.binary, dict(job.params, payload=payload), job.run,
+                       command=command, cwd=protocol.cwd, env=env)
+    if store.completed(job.id, retry_exceeded):
+        print(f"Skipping {job}, already recorded as {store.status(job.id)} ({job.id})")
+        return store.status(job.id)
+    if not ceilings.allows(job.name, job.payload_byte_size, job.num_rows):
+        print(f"Skipping {job}, a smaller size already exceeded its budget")
+        return "skipped"
+    run_command_no_output(["mkdir", "-p", os.path.join(job.log_dir, job.name)])
+    timeout, max_rss_kb = protocol.limits(sweep)
+    base = f"{job.log_dir}/{job.name}/{job.id}"
+    status = run_command(command, f"{base}.txt", cwd=protocol.cwd, env=env, cores=cores,
+                         timeout=timeout, max_rss_kb=max_rss_kb)
+    if status == "success":
+        try:
+            protocol.parse(f"{base}.txt", f"{base}.json", job.num_rows, payload)
+            with open(f"{base}.usage.json") as f:
+                merge_usage(f"{base}.json", json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"Failed to parse the output of {job.name}: {e}")
+            status = "failed"
+    elif status == "exceeded":
+        ceilings.exceeded(job.name, job.payload_byte_size, job.num_rows)
+    else:
+        print(f"Failed to run {job.name}")
+    store.record(job.id, status, protocol=job.name, run=job.run, log_dir=job.log_dir, **job.params)
+    print(f"Done {job} on cores {cores}: {status}")
+    return status
+
+
+class Series:
+    """All repetitions of one configuration, run back to back on the same cores in adaptive mode."""
+
+    def __init__(self, protocol, num_rows, log_num_rows, payload_byte_size):
+        self.protocol = protocol
+        self.num_rows = num_rows
+        self.log_num_rows = log_num_rows
+        self.payload_byte_size = payload_byte_size
+        self.threads = protocol.threads
+
+    @property
+    def name(self):
+        return self.protocol.name
+
+    def job(self, run):
+        return Job(self.protocol, self.num_rows, self.log_num_rows, self.payload_byte_size, run)
+
+    def __repr__(self):
+        return f"Series({self.name}, num_rows={self.num_rows}, payload={self.payload_byte_size})"
+
+
+def build_series(registry, sweep):
+    return [Series(job.protocol, job.num_rows, job.log_num_rows, job.payload_byte_size)
+            for job in build_jobs(registry, dict(sweep, runs=1))]
+
+
+def run_metrics(job):
+    """Common-schema metrics (see ingest.py) of a finished job, from its parsed JSON."""
+    with open(f"{job.log_dir}/{job.name}/{job.id}.json") as f:
+        results = json.load(f)
+    return {metric: value for metric, value, _, raw in normalize(job.protocol, results) if not raw}
+
+
+def run_series(series, cores, store, ceilings, sweep, retry_exceeded=False):
+    """Repeat a configuration until its key metric is stable, then summarize every metric.
+
+    Runs continue past min_runs until the confidence interval of the median of
+    adaptive.metric (server_time by default, wall_time for protocols that do not report
+    it) is within target_rel_error of the median, or until max_runs runs or budget_s
+    seconds of wall time have been spent. Runs recorded in the result store are reused.
+    The median, IQR and CI of every metric are written to {log_dir}/{protocol}.summary.json.
+    """
+    adaptive = sweep["adaptive"]
+    samples = {}
+    statuses = []
+    spent = 0.0
+    summary = None
+    while len(statuses) < adaptive["max_runs"]:
+        job = series.job(len(statuses))
+        status = run_job(job, cores, store, ceilings, sweep, retry_exceeded)
+        statuses.append(status)
+        if status != "success":
+            # Failures repeat deterministically and exceeded budgets only get worse
+            break
+        try:
+            metrics = run_metrics(job)
+        except (OSError, ValueError) as e:
+            print(f"Failed to read the results of {job}: {e}")
+            break
+        for metric, value in metrics.items():
+            samples.setdefault(metric, []).append(value)
+        spent += metrics.get("wall_time", 0) / 1e6
+
+        key = adaptive["metric"] if adaptive["metric"] in samples else "wall_time"
+        summary = summarize(samples[key], adaptive["confidence"])
+        if len(statuses) >= adaptive["min_runs"] and summary["rel_error"] is not None \
+                and summary["rel_error"] <= adaptive["target_rel_error"]:
+            break
+        if adaptive["budget_s"] is not None and spent >= adaptive["budget_s"]:
+            print(f"{series} ran out of its {adaptive['budget_s']} s budget after {len(statuses)} runs")
+            break
+
+    if summary is not None:
+        metrics = {metric: summarize(values, adaptive["confidence"]) for metric, values in samples.items()}
+        stable = summary["rel_error"] is not None and summary["rel_error"] <= adaptive["target_rel_error"]
+        interference = any(s["interference"] for s in metrics.values())
+        report = {
+            "protocol": series.name,
+            "num_rows": series.num_rows,
+            "payload_byte_size": series.payload_byte_size,
+            "runs": len(statuses),
+            "key_metric": key,
+            "target_rel_error": adaptive["target_rel_error"],
+            "stable": stable,
+            "interference": interference,
+            "metrics": metrics,
+        }
+        log_dir = series.job(0).log_dir
+        with open(f"{log_dir}/{series.name}.summary.json", 'w') as f:
+            json.dump(report, f, indent=4)
+        print(f"{series}: {key} median {summary['median']:.0f} (+/-{100 * (summary['rel_error'] or 0):.1f}%) "
+              f"after {len(statuses)} runs" + ("" if stable else ", NOT stable") +
+              (", possible interference" if interference else ""))
+    return statuses
 
-def parse_cwpir(log_dir, num_rows, item_size, id):
-    # Open the file and read the content
-    with open(f'{log_dir}/cwpir/{id}.txt', 'r') as file:
-        log_content = file.read()
-
-    patterns = {
-        'Poly Mod Degree' : r'Poly Mod Degree:\s+(\d+)',
-        'Number of Keywords' : r'Number of Keywords:\s+(\d+)',
-        'Hamming Weight' : r'Hamming Weight:\s+(\d+)',
-        'Database Prep (ms)' : r'Database Prep\s+:\s+(\d+)',
-        'Total Server (ms)' : r'Total Server\s+:\s+(\d+)',
-        'Data Independant KB (Relin keys)' : r'Data Independant:\s+(\d+) KB \(Relin keys\)',
-        'Data Independant KB (Gal Keys)' : r'Data Independant:.+\+ (\d+) KB \(Gal Keys\)',
-        'Data Dependant KB (Query)' : r'Data Dependant: (\d+) KB \(Query\)',
-        'Data Dependant KB (Reponse)' : r'Data Dependant:.+\+ (\d+) KB \(Reponse\)',
-    }
-
-    results = {
-        "Number of items": num_rows,
-        "Item size (B)": item_size,
-    }
-    for field_name, pattern in patterns.items():
-        match = re.search(pattern, log_content, re.DOTALL)
-        if match:
-            results[field_name] = int(match.group(1))
-        else:
-            results[field_name] = None
-
-
-    # Write the extracted values to a JSON file
-    with open(f'{log_dir}/cwpir/{id}.json', 'w') as json_file:
-        json.dump(results, json_file, indent=4)
-
-def parse_sealpir(log_dir, num_rows, item_size, id):
-    try:
-        with open(f"{log_dir}/sealpir/{id}.txt", 'r') as f:
-            log_data = f.read()
-    except FileNotFoundError:
-        return "File not found. Please check the file path."
-
-    data_dict = {}
-    
-    fields_to_extract = [
-        "number_of_elements",
-        "max_element_size",
-        "PIRServer_reply_generation_time",
-        "query_size",
-        "reply_size",
-        "size_gal_keys",
-    ]
-    
-    for field in fields_to_extract:
-        pattern = re.compile(rf"{field}: (\d+)")
-        match = pattern.search(log_data)
-        if match:
-            data_dict[field] = int(match.group(1))
-        else:
-            data_dict[field] = None
-
-    # Write the extracted values to a JSON file
-    with open(f'{log_dir}/sealpir/{id}.json', 'w') as json_file:
-        json.dump(data_dict, json_file, indent=4)
-
-def parse_spiral(log_dir, num_rows, item_size, id, version="spiral"):
-
-    log_content = json.load(open(f"{log_dir}/{version}/{id}.txt", 'r'))
-
-    log_content["Number of items"] = num_rows
-    log_content["Item size (B)"] = item_size
-
-    with open(f'{log_dir}/{version}/{id}.json', 'w') as json_file:
-        json.dump(log_content, json_file, indent=4)
-
-    # with open(f"{log_dir}/{version}/{id}.txt", 'r') as file:
-    #     log_content = file.read()
-    
-    # patterns = {
-    #     "Number of items" : r"Number of items\s*:\s*(\d+)",
-    #     "n" : r"PIR over n=(\d+) elements",
-    #     "Item size (B)" : r"Item size\s*:\s*(\d+)",
-    #     "size (B)" : r"elements of size (\d+) bytes each",
-    #     "Total offline query size (B)": r"Total offline query size\s*\(b\)\s*:\s*(\d+)",
-    #     "First dimension": r"First dimension\s*\(b\)\s*:\s*(\d+)",
-    #     "Total for other dimensions": r"Total for other dimensions\s*\(b\)\s*:\s*(\d+)",
-    #     "Total online query size (B)": r"Total online query size\s*\(b\)\s*:\s*(\d+)",
-    #     "Response size (B)": r"Response size\s*\(b\)\s*:\s*(\d+)",
-    #     "Main expansion (us)": r"Main expansion\s*\(CPU·us\)\s*:\s*(\d+)",
-    #     "Further dimension expansion (us)": r"Further dimension expansion\s*\(CPU·us\)\s*:\s*(\d+)",
-    #     "Conversion (us)": r"Conversion \(CPU·us\)\s*:\s*(\d+)",
-    #     "Database-independent computation Total (us)": r"Database-independent computation.*?Total \(CPU·us\)\s*:\s*(\d+)",
-    #     "First dimension multiply (us)": r"First dimension multiply \(CPU·us\)\s*:\s*(\d+)",
-    #     "Folding (us)": r"Folding \(CPU·us\): (\d+)",
-    #     "Database-dependent computation Total (us)": r"Database-dependent computation.*?Total \(CPU·us\)\s*:\s*(\d+)",
-    #     "Key generation (us)": r"Key generation \(CPU·us\)\s*:\s*(\d+)",
-    #     "Query generation (us)": r"Query generation \(CPU·us\)\s*:\s*(\d+)",
-    #     "Decoding (us)": r"Decoding \(CPU·us\)\s*:\s*(\d+)"
-    # }
-    
-    # results = {}
-    # for field_name, pattern in patterns.items():
-    #     match = re.search(pattern, log_content, re.DOTALL)
-    #     if match:
-    #         results[field_name] = int(match.group(1))
-    #     else:
-    #         results[field_name] = None
-    
-    # with open(f'{log_dir}/{version}/{id}.json', 'w') as json_file:
-    #     json.dump(results, json_file, indent=4)
-              
-def parse_fastpir(log_dir, num_rows, item_size, id):
-    # Open the file and read the content
-    with open(f'{log_dir}/fastpir/{id}.txt', 'r') as file:
-        data = file.read()
-
-    # Define the regex patterns for each item to be extracted
-    patterns = {
-        "Gal Keys (B)": r"Gal Keys: (\d+) bytes",
-        "Query size (B)": r"Query size: (\d+) bytes",
-        "Response size (B)": r"Response size: (\d+) bytes",
-        "DB preprocessing time (us)": r"DB preprocessing time \(us\): (\d+)",
-        "Query generation time (us)": r"Query generation time \(us\): (\d+)",
-        "Response generation time (us)": r"Response generation time \(us\): (\d+)",
-        "Response decode time (us)": r"Response decode time \(us\): (\d+)"
-    }
-
-    # Create a dictionary to store the extracted values
-    extracted_values = {
-        "Number of items": num_rows,
-        "Item size (B)": item_size,       
-    }
-
-    # Loop through each pattern and find the matching value in the data
-    for key, pattern in patterns.items():
-        match = re.search(pattern, data)
-        if match:
-            extracted_values[key] = int(match.group(1))
-        else:
-            extracted_values[key] = None
-
-    # Write the extracted values to a JSON file
-    with open(f'{log_dir}/fastpir/{id}.json', 'w') as json_file:
-        json.dump(extracted_values, json_file, indent=4)
-
-def parse_onionpir(log_dir, num_rows, item_size, id):
-    # Open the file and read the content
-    with open(f'{log_dir}/onionpir/{id}.txt', 'r') as file:
-        data = file.read()
-
-    # Define the regex patterns for each item to be extracted
-    patterns = {
-        "Gal Keys (KB)": r"Gal keys Size: (\d+) KB",
-        "Encrypted Secret Key (KB)": r"Encrypted Secret Key Size: (\d+) KB",
-        "Query size (KB)": r"Query Size: (\d+) KB",
-        "Reply size (KB)": r"Reply Size: (\d+) KB",
-        "Preprocessing time (ms)": r"Main: PIRServer pre-processing time: (\d+) ms",
-        "Query generation time (ms)": r"Main: PIRClient query generation time: (\d+) ms",
-        "Reply time (ms)": r"Main: PIRServer reply generation time: (\d+) ms",
-    }
-
-    # Create a dictionary to store the extracted values
-    extracted_values = {
-        "Number of items": num_rows,
-        "Item size (B)": item_size,       
-    }
-
-    # Loop through each pattern and find the matching value in the data
-    for key, pattern in patterns.items():
-        match = re.search(pattern, data)
-        if match:
-            extracted_values[key] = int(match.group(1))
-        else:
-            extracted_values[key] = None
-
-    # Write the extracted values to a JSON file
-    with open(f'{log_dir}/onionpir/{id}.json', 'w') as json_file:
-        json.dump(extracted_values, json_file, indent=4)
-
-def parse_rlwepir(log_dir, num_rows, item_size, id, version='RLWE_All_Keys'):
-    # Open the log file and read the content
-    with open(f'{log_dir}/{version}/{id}.txt', 'r') as file:
-        data = file.read()
-
-    # Define the regex patterns for each item to be extracted
-    patterns = {
-        "log2_num_rows": r"log_2_num_rows:\s+(\d+)",
-        "log_2_num_db_rows": r"log_2_num_db_rows:\s+(\d+)",
-        "time for key expansion (ms)": r"time elapsed for key expansion \(ms\):\s+(\d+)",
-        "time for transformDB (ms)": r"time elapsed for transformDBToPlaintextForm \(ms\) is:\s+(\d+)",
-        "server time (ms)": r"server PIR time \(ms\):\s+(\d+)",
-        "request size (B)": r"request size B:\s+(\d+)",
-        "response size (B)": r"response size B:\s+(\d+)"
-    }
-
-    # Create a dictionary to store the extracted values
-    extracted_values = {
-        "Number of items": num_rows,
-        "Item size (B)": item_size,
-    }
-
-    # Loop through each pattern and find the matching value in the data
-    for key, pattern in patterns.items():
-        match = re.search(pattern, data)
-        if match:
-            extracted_values[key] = int(match.group(1))
-        else:
-            extracted_values[key] = None
-
-    # Write the extracted values to a JSON file
-    with open(f'{log_dir}/{version}/{id}.json', 'w') as json_file:
-        json.dump(extracted_values, json_file, indent=4)
-
-def random_id():
-    return time.time_ns() % 1000000000
 
 def main():
-    
-    for run in range(3):
-        # Payload size of 0 means that each protocol will the largest payload size it supports
-        for payload_byte_size in [0]:
-            for log_num_rows in [10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20]:
-                num_rows = 2**log_num_rows
-                log_dir = f"logs/logs-{num_rows}-{payload_byte_size}"
-                
-                log_num_rows = int(math.log(num_rows, 2))
-                run_command_no_output(["mkdir", "-p", log_dir])
-
-                # SealPIR
-                run_command_no_output(["mkdir", "-p", os.path.join(log_dir, "sealpir")])
-                sealpir_payload_byte_size = 10240 if payload_byte_size == 0 else payload_byte_size
-                id = random_id()
-                if run_command(["SealPIR-clone/bin/main2", str(num_rows), str(sealpir_payload_byte_size)], f"{log_dir}/sealpir/{id}.txt"):
-                    parse_sealpir(log_dir, num_rows, sealpir_payload_byte_size, id)
-                else :
-                    print("Failed to run SealPIR")
-
-                # FastPIR
-                run_command_no_output(["mkdir", "-p", os.path.join(log_dir, "fastpir")])
-                fastpir_payload_byte_size = 10240 if payload_byte_size == 0 else payload_byte_size
-                command = ["FastPIR-clone/bin/fastpir", "-n", str(num_rows), "-s", str(fastpir_payload_byte_size)]
-                id = random_id()
-                if run_command(command, f"{log_dir}/fastpir/{id}.txt"):
-                    parse_fastpir(log_dir, num_rows, fastpir_payload_byte_size, id)
-                else:
-                    print("Failed to run FastPIR")
-
-                # # Constant-weight PIR
-                # run_command_no_output(["mkdir", "-p", os.path.join(log_dir, "cwpir")])
-                # command = ["constant-weight-pir/src/build/main", f"--num_keywords={num_rows}", f"--response_bytesize={payload_byte_size}"]
-                # id = random_id()
-                # if run_command(command, f"{log_dir}/cwpir/{id}.txt"):
-                #     parse_cwpir(log_dir, num_rows, payload_byte_size, id)
-                # else:
-                #     print("Failed to run Constant-weight PIR")
-                
-                # OnionPIR
-                run_command_no_output(["mkdir", "-p", os.path.join(log_dir, "onionpir")])
-                onionpir_payload_byte_size = 30720 if payload_byte_size == 0 else payload_byte_size
-                command = ["Onion-PIR-clone/onionpir", str(num_rows), str(onionpir_payload_byte_size)]
-                id = random_id()
-                if run_command(command, f"{log_dir}/onionpir/{id}.txt"):
-                    parse_onionpir(log_dir, num_rows, onionpir_payload_byte_size, id)
-                else:
-                    print("Failed to run OnionPIR")
-
-                # Spiral Variants
-                
-                # Hacky line. Should fix it later
-                run_command_no_output(["cp", "spiral-clone/build/spiral", "spiral-clone/"])
-
-                spiral_payload_byte_size = 256*1024 if payload_byte_size == 0 else payload_byte_size
-                base_spiral_command = ["python3", "select_params.py", "--quiet", "--skip-cmake", "--skip-make", f"{log_num_rows}", f"{spiral_payload_byte_size}"]
-                for flags, name in [
-                    ([], "spiral"),
-                    (["--direct-upload"], "spiral-stream"),
-                    (["--pack"], "spiral-pack"),
-                    (["--direct-upload", "--pack"], "spiral-stream-pack")
-                ]:
-                    run_command_no_output(["mkdir", "-p", os.path.join(log_dir, name)])
-                    command = base_spiral_command
-                    id = random_id()
-                    if run_command(command+flags, f"{log_dir}/{name}/{id}.txt", cwd="spiral-clone"):
-                        parse_spiral(log_dir, num_rows, spiral_payload_byte_size, id, name)
-                    else:
-                        print("Failed to run Spiral")
-
-                # RLWEPIR
-                if log_num_rows <= 16:
-                    rlwe_payload_byte_size = 256*1024 if payload_byte_size == 0 else payload_byte_size
-                    log2_num_rows = math.ceil(math.log2(num_rows))
-                    # for mode in ["RLWE_All_Keys", "RLWE_Whispir_3_Keys", "RLWE_Whispir_2_Keys"]:
-                    for mode in ["RLWE_All_Keys"]:
-                        run_command_no_output(["mkdir", "-p", os.path.join(log_dir, mode)])
-
-                        command = [f"go", "test", "-v", "-timeout", "99999s", "./pir/...", "-run", "E2E"]
-                        env_vars = {
-                            'LOG2_NUMBER_OF_ROWS': f'{log2_num_rows}',
-                            'LOG2_NUM_DB_ROWS': f'{log2_num_rows}',
-                            'ROW_SIZE': f'{rlwe_payload_byte_size}',
-                            'MODE': f'{mode}'
-                        }
-                        id = random_id()
-                        if run_command(command, f"{log_dir}/{mode}/{id}.txt", cwd="private-zikade", env=env_vars):
-                            parse_rlwepir(log_dir, num_rows, rlwe_payload_byte_size, id, mode)
-                        else:
-                            print(f"Failed to run {mode}")
-
-                print(f"Done run {run}, num_rows {num_rows}, payload_byte_size {payload_byte_size}")
+    parser = argparse.ArgumentParser(description="Run the PIR benchmark sweep")
+    parser.add_argument("--sweep", type=str, default="sweep.toml", help="sweep matrix (TOML)")
+    parser.add_argument("--protocols", type=str, default="protocols.toml", help="protocol registry (TOML)")
+    parser.add_argument("--mode", choices=Scheduler.MODES, default=None,
+                        help="exclusive: one job at a time (comparable timings); packed: fill all cores "
+                             "(default: the sweep's mode)")
+    parser.add_argument("--cores", type=str, default=None,
+                        help="comma-separated list of cores to use (default: all available)")
+    parser.add_argument("--results", type=str, default="logs/results.jsonl",
+                        help="result store used to skip completed jobs and retry failed ones")
+    parser.add_argument("--retry-exceeded", action="store_true",
+                        help="rerun jobs that exceeded their budget (e.g. after raising it)")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="repeat each configuration until its server time is stable instead of a "
+                             "fixed number of runs (settings in the sweep's [adaptive] table)")
+    args = parser.parse_args()
+
+    registry = load_protocols(args.protocols)
+    sweep = load_sweep(args.sweep, adaptive=args.adaptive)
+    cores = [int(c) for c in args.cores.split(",")] if args.cores else available_cores()
+
+    for setup in {tuple(registry[name].setup) for name in sweep["protocols"] if registry[name].setup}:
+        run_command_no_output(list(setup))
+
+    store = ResultStore(args.results)
+    ceilings = SizeCeilings(None if args.retry_exceeded else store)
+    if sweep["adaptive"] is not None:
+        jobs = build_series(registry, sweep)
+        run = partial(run_series, store=store, ceilings=ceilings, sweep=sweep, retry_exceeded=args.retry_exceeded)
+        statuses = [status for series in Scheduler(run, cores, args.mode or sweep["mode"]).run(jobs)
+                    for status in series]
+    else:
+        jobs = build_jobs(registry, sweep)
+        run = partial(run_job, store=store, ceilings=ceilings, sweep=sweep, retry_exceeded=args.retry_exceeded)
+        statuses = Scheduler(run, cores, args.mode or sweep["mode"]).run(jobs)
+    print(", ".join(f"{statuses.count(s)} {s}" for s in sorted(set(statuses))) + f" of {len(statuses)} jobs")
+    print(f"Ingested {ingest(registry=registry)} new result files into logs/results.sqlite")
 
 if __name__ == "__main__":
     main()
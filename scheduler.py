@@ -0,0 +1,79 @@
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+def available_cores():
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+
+
+def pin_to(command, cores):
+    """Return command prefixed with taskset so that it runs on the given cores (unchanged if unsupported).
+
+    Jobs are started from worker threads, where a preexec_fn could deadlock the child
+    between fork and exec, so the pinning is left to taskset in the child instead.
+    """
+    if not cores or shutil.which("taskset") is None:
+        return list(command)
+    return ["taskset", "-c", ",".join(map(str, sorted(cores)))] + list(command)
+
+
+class CorePool:
+    """Hands out disjoint sets of CPU cores to concurrently running jobs."""
+
+    def __init__(self, cores):
+        self.cores = list(cores)
+        self._free = list(cores)
+        self._cond = threading.Condition()
+
+    def acquire(self, count):
+        """Block until count cores are free, then reserve and return them."""
+        count = max(1, min(count, len(self.cores)))
+        with self._cond:
+            while len(self._free) < count:
+                self._cond.wait()
+            taken, self._free = self._free[:count], self._free[count:]
+            return taken
+
+    def release(self, cores):
+        with self._cond:
+            self._free = sorted(self._free + list(cores))
+            self._cond.notify_all()
+
+
+class Scheduler:
+    """Runs benchmark jobs on a worker pool, each pinned to its own cores.
+
+    run_job(job, cores) executes one job on the given list of cores; job.threads is the
+    number of cores the job needs (more for multithreaded protocols).
+
+    In "exclusive" mode one job runs at a time, pinned to job.threads cores, and the rest
+    of the machine stays idle, so timings are comparable with a plain sequential sweep.
+    In "packed" mode as many jobs run concurrently as there are free cores, which is much
+    faster but lets jobs share caches and memory bandwidth.
+    """
+
+    MODES = ("exclusive", "packed")
+
+    def __init__(self, run_job, cores=None, mode="exclusive"):
+        assert mode in self.MODES, f"mode must be one of {self.MODES}"
+        self.run_job = run_job
+        self.pool = CorePool(available_cores() if cores is None else cores)
+        self.mode = mode
+
+    def _run(self, job):
+        cores = self.pool.acquire(job.threads)
+        try:
+            return self.run_job(job, cores)
+        finally:
+            self.pool.release(cores)
+
+    def run(self, jobs):
+        """Run all jobs and return their results in job order."""
+        workers = 1 if self.mode == "exclusive" else len(self.pool.cores)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(self._run, jobs))
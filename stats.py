@@ -0,0 +1,61 @@
+import math
+import statistics
+
+
+def median_ci(values, confidence=0.95):
+    """Distribution-free confidence interval for the median, from order statistics.
+
+    The interval [x_(k), x_(n-k+1)] of the sorted values covers the median with
+    probability 1 - 2 P(Binomial(n, 1/2) < k); k is the largest rank that keeps this at or
+    above confidence. Returns None if there are too few values for any such k (fewer than
+    6 at 95%).
+    """
+    xs = sorted(values)
+    n = len(xs)
+    alpha = (1 - confidence) / 2
+    tail, k = 0.0, 0
+    # tail = P(Binomial(n, 1/2) <= k - 1)
+    while k < n // 2:
+        next_tail = tail + math.comb(n, k) / 2**n
+        if next_tail > alpha:
+            break
+        tail, k = next_tail, k + 1
+    if k == 0:
+        return None
+    return xs[k - 1], xs[n - k]
+
+
+def summarize(values, confidence=0.95, outlier_iqr=3.0):
+    """Median, IQR, median confidence interval and interference flag of repeated measurements.
+
+    rel_error is the larger distance from the median to a CI bound, relative to the median
+    (None while the CI is not defined yet). Runs slowed down by other jobs on the machine
+    show up as a long upper tail: a value more than outlier_iqr IQRs above the third
+    quartile sets interference.
+    """
+    n = len(values)
+    median = statistics.median(values)
+    q1, _, q3 = statistics.quantiles(values, n=4, method="inclusive") if n > 1 else (median,) * 3
+    iqr = q3 - q1
+    ci = median_ci(values, confidence)
+    if ci is None or (median == 0 and ci != (0, 0)):
+        rel_error = None
+    elif median == 0:
+        rel_error = 0.0
+    else:
+        rel_error = max(median - ci[0], ci[1] - median) / abs(median)
+    slow = [v for v in values if v > q3 + outlier_iqr * iqr] if iqr > 0 else []
+    return {
+        "n": n,
+        "median": median,
+        "q1": q1,
+        "q3": q3,
+        "iqr": iqr,
+        "ci": list(ci) if ci is not None else None,
+        "confidence": confidence,
+        "rel_error": rel_error,
+        "min": min(values),
+        "max": max(values),
+        "interference": bool(slow),
+        "slow_outliers": slow,
+    }
@@ -0,0 +1,172 @@
+import argparse
+import itertools
+import math
+
+import numpy as np
+
+from ingest import query
+from protocols import load_protocols
+
+# Candidate terms of the server-time model, as functions of the number of rows N and the
+# item size in bytes P. Times are in us (the common schema of ingest.py).
+TERMS = {
+    "N*payload": lambda N, P: N * P,
+    "N": lambda N, P: N,
+    "1": lambda N, P: np.ones_like(N),
+}
+
+
+def _nnls(A, y):
+    """Least squares with non-negative coefficients, by trying every subset of columns.
+
+    The models have a handful of terms, so enumerating the 2^k active sets is both exact
+    and cheap, and keeps a negative constant from hiding a linear cost.
+    """
+    best, best_residual = np.zeros(A.shape[1]), np.sum(y ** 2)
+    for k in range(1, A.shape[1] + 1):
+        for columns in itertools.combinations(range(A.shape[1]), k):
+            coef, *_ = np.linalg.lstsq(A[:, columns], y, rcond=None)
+            if np.any(coef < 0):
+                continue
+            residual = np.sum((A[:, columns] @ coef - y) ** 2)
+            if residual < best_residual:
+                best = np.zeros(A.shape[1])
+                best[list(columns)] = coef
+                best_residual = residual
+    return best
+
+
+class TimeModel:
+    """Server time of one protocol as a non-negative combination of TERMS.
+
+    The fit minimizes relative rather than absolute error (every row is divided by the
+    measured time), since the sweep spans several orders of magnitude and the small sizes
+    would otherwise not count. When the sweep used a single payload, N*payload cannot be
+    told apart from N and is dropped; predictions at other payloads are then flagged.
+    """
+
+    def __init__(self, protocol, num_rows, payloads, times, run_ids=None, terms=("N*payload", "N", "1"),
+                 threads=1):
+        self.protocol = protocol
+        self.threads = threads
+        N = np.asarray(num_rows, dtype=float)
+        P = np.asarray(payloads, dtype=float)
+        y = np.asarray(times, dtype=float)
+        self.payloads = sorted(set(P.tolist()))
+        if len(self.payloads) == 1:
+            terms = [t for t in terms if t != "N*payload"]
+        self.terms = list(terms)
+        A = self._design(N, P)
+        self.coef = _nnls(A / y[:, None], np.ones_like(y))
+        self.fitted = A @ self.coef
+        self.num_rows, self.payload, self.times = N, P, y
+        self.run_ids = list(run_ids) if run_ids is not None else [None] * len(y)
+        self.rel_residuals = (y - self.fitted) / self.fitted
+
+    def _design(self, N, P):
+        return np.column_stack([TERMS[t](N, P) for t in self.terms])
+
+    @property
+    def r2(self):
+        """Coefficient of determination on log time, so every size counts equally."""
+        log_y, log_fit = np.log(self.times), np.log(self.fitted)
+        total = np.sum((log_y - log_y.mean()) ** 2)
+        return 1.0 if total == 0 else 1 - np.sum((log_y - log_fit) ** 2) / total
+
+    @property
+    def rel_rmse(self):
+        return float(np.sqrt(np.mean(self.rel_residuals ** 2)))
+
+    def predict(self, num_rows, payload):
+        """Predicted server time in us for arrays (or scalars) of rows and item sizes."""
+        N, P = np.broadcast_arrays(np.asarray(num_rows, dtype=float), np.asarray(payload, dtype=float))
+        return self._design(N.ravel(), P.ravel()).dot(self.coef).reshape(N.shape)
+
+    def throughput(self, num_rows, payload):
+        """Queries per second per core: one query keeps `threads` cores busy for its server time."""
+        return 1e6 / (self.predict(num_rows, payload) * self.threads)
+
+    def extrapolates_payload(self, payload):
+        return len(self.payloads) == 1 and payload != self.payloads[0]
+
+    def outliers(self, threshold=3.5, min_rel=0.1):
+        """Measured points far from the fit: (run_id, num_rows, payload, time, relative residual).
+
+        A point is flagged when its log residual is more than threshold robust standard
+        deviations (1.4826 MAD) from the median log residual, and also off by more than
+        min_rel relative to the fit, so a near-perfect fit does not flag tiny jitter.
+        """
+        log_res = np.log(self.times / self.fitted)
+        mad = 1.4826 * np.median(np.abs(log_res - np.median(log_res)))
+        z = np.abs(log_res - np.median(log_res)) / mad if mad > 0 else np.zeros_like(log_res)
+        flagged = (z > threshold) & (np.abs(self.rel_residuals) > min_rel)
+        return [(self.run_ids[i], int(self.num_rows[i]), int(self.payload[i]), float(self.times[i]),
+                 float(self.rel_residuals[i])) for i in np.flatnonzero(flagged)]
+
+    def formula(self):
+        return " + ".join(f"{c:.4g}*{t}" if t != "1" else f"{c:.4g}" for c, t in zip(self.coef, self.terms))
+
+
+def fit(db_path="logs/results.sqlite", registry=None, protocols=None, terms=("N*payload", "N", "1")):
+    """Fit a TimeModel per protocol from the server_time of every ingested run.
+
+    The payload of a run is its item_size, which run.py records after resolving a sweep
+    payload of 0 to the protocol's default_payload. Runs without it fall back to resolving
+    their sweep payload_byte_size through the registry.
+    """
+    runs = query(db_path, metrics=["server_time", "num_items", "item_size"], protocol=protocols)
+    by_protocol = {}
+    for run in runs:
+        if "server_time" in run and run["server_time"] > 0:
+            by_protocol.setdefault(run["protocol"], []).append(run)
+    models = {}
+    for name, points in by_protocol.items():
+        if len({p["num_rows"] for p in points}) < 2:
+            print(f"Skipping {name}: server time measured at a single size only")
+            continue
+        protocol = registry.get(name) if registry else None
+        threads = protocol.threads if protocol else 1
+        resolve = protocol.payload if protocol else (lambda payload_byte_size: payload_byte_size)
+        models[name] = TimeModel(
+            name,
+            [p.get("num_items", p["num_rows"]) for p in points],
+            [p.get("item_size", resolve(p["payload_byte_size"])) for p in points],
+            [p["server_time"] for p in points],
+            run_ids=[p["run_id"] for p in points],
+            terms=terms,
+            threads=threads,
+        )
+    return models
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit server-time models to the ingested sweep results")
+    parser.add_argument("--db", default="logs/results.sqlite")
+    parser.add_argument("--protocols", default="protocols.toml")
+    parser.add_argument("--only", nargs="*", default=None, help="protocols to fit (default: all)")
+    parser.add_argument("--log-num-rows", nargs="*", type=int, default=[22, 23, 24, 25, 26],
+                        help="sizes to predict, as log2 of the number of rows")
+    parser.add_argument("--payload", type=int, default=None,
+                        help="item size in bytes to predict for (default: each protocol's measured one)")
+    parser.add_argument("--threshold", type=float, default=3.5, help="robust z-score that flags a point")
+    args = parser.parse_args()
+
+    registry = load_protocols(args.protocols)
+    for name, model in sorted(fit(args.db, registry, args.only).items()):
+        payload = args.payload if args.payload is not None else int(model.payloads[-1])
+        print(f"{name}: time (us) = {model.formula()}")
+        print(f"    {len(model.times)} runs, R^2 (log) = {model.r2:.4f}, relative RMSE = {100 * model.rel_rmse:.1f}%")
+        if model.extrapolates_payload(payload):
+            print(f"    only payload {model.payloads[0]:.0f} B was measured; predictions at {payload} B are unreliable")
+        for log_num_rows in args.log_num_rows:
+            num_rows = 2 ** log_num_rows
+            time_us = float(model.predict(num_rows, payload))
+            qps = float(model.throughput(num_rows, payload))
+            print(f"    2^{log_num_rows} rows x {payload} B: {time_us / 1e6:.3f} s, {qps:.4g} queries/s/core")
+        for run_id, num_rows, run_payload, time_us, rel in model.outliers(args.threshold):
+            print(f"    outlier {run_id}: 2^{math.log2(num_rows):.0f} rows x {run_payload} B "
+                  f"took {time_us / 1e6:.3f} s ({100 * rel:+.0f}% vs fit)")
+
+
+if __name__ == "__main__":
+    main()